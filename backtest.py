@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Replays the market history through the order pricing logic of updateOrders,
+# for many pricing parameter combinations at once, and reports what each
+# would have paid and how much hashrate it would have bought.
+#
+#   ./backtest.py --history market_history --location 0 --algo 38 --days 14 \
+#       --max-increase 0.0001,0.0002,0.0005 --min-add 0,0.0001 --strategy minimum,percentile:10
+
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+from history import MarketHistory, HistorySlice
+from pricing import STRATEGIES
+from planner import PRICE_EPSILON
+import nicehash
+
+
+# A target strategy and its parameter: ("minimum", None), ("percentile", 10), ("depth", 0.5)
+def parseStrategy(text):
+    name, _, value = text.partition(":")
+    if name not in STRATEGIES:
+        raise ValueError("Unknown target strategy: {}".format(name))
+    if name in ["percentile", "depth"]:
+        return (name, float(value) if value else (10.0 if name == "percentile" else 0.0))
+    return (name, None)
+
+
+def strategyName(strategy):
+    name, value = strategy
+    return name if value is None else "{}:{:g}".format(name, value)
+
+
+# The order books of one market over time, reduced to what the replay needs.
+#   timestamps:  snapshot times
+#   floor:       lowest price with miners working on it, the price that gets filled
+#   targets:     {strategy: target price per snapshot}
+class Replay:
+    def __init__(self, timestamps, floor, targets):
+        self.timestamps = timestamps
+        self.floor = floor
+        self.targets = targets
+
+    def __len__(self):
+        return self.timestamps.size
+
+    # Compute every strategy's target for each snapshot of a history slice.
+    # Snapshots without working orders are skipped.
+    @classmethod
+    def from_history(cls, data, strategies):
+        percentiles = [value for name, value in strategies if name == "percentile"]
+        depths = [value for name, value in strategies if name == "depth"]
+        timestamps, floor = [], []
+        targets = {strategy: [] for strategy in strategies}
+        for timestamp, location, algo, book in data.books():
+            try:
+                values = book.targets(percentiles=percentiles, depths=depths)
+            except ValueError:
+                continue
+            timestamps.append(timestamp)
+            floor.append(values["minimum"])
+            for strategy in strategies:
+                name, value = strategy
+                if name == "percentile":
+                    targets[strategy].append(values[name][percentiles.index(value)])
+                elif name == "depth":
+                    targets[strategy].append(values[name][depths.index(value)])
+                else:
+                    targets[strategy].append(values[name])
+        return cls(np.array(timestamps, dtype=np.float64), np.array(floor, dtype=np.float64),
+                   {strategy: np.array(values, dtype=np.float64) for strategy, values in targets.items()})
+
+
+# Every combination of the parameter lists, as one array per parameter
+def grid(strategies, max_increases, min_adds, decrease_cooldowns, increase_intervals):
+    combos = list(itertools.product(range(len(strategies)), max_increases, min_adds,
+                                    decrease_cooldowns, increase_intervals))
+    columns = list(zip(*combos)) if combos else [[]] * 5
+    return {
+        "strategy": np.array(columns[0], dtype=np.int64),     # Index into strategies
+        "max_increase": np.array(columns[1], dtype=np.float64),
+        "min_add": np.array(columns[2], dtype=np.float64),
+        "decrease_cooldown": np.array(columns[3], dtype=np.float64),    # Seconds
+        "increase_interval": np.array(columns[4], dtype=np.float64),    # Seconds
+    }
+
+
+# Replay a market for every parameter combination at once.
+# Time advances in ticks of tick seconds. At each tick every combination moves its
+# price toward its target the way the planner does, one decrease_step per
+# decrease_cooldown and up to max_increase per increase_interval, and is filled
+# when its price is at or above the lowest working price of the latest snapshot.
+# Returns {"avg_price", "hashrate", "unfilled"} arrays, one entry per combination.
+def backtest(replay, strategies, params, tick=60.0, limit_speed=0.01, decrease_step=nicehash.DECREASE_STEP):
+    count = params["strategy"].size
+    if len(replay) == 0 or count == 0:
+        raise ValueError("Nothing to backtest")
+    ticks = np.arange(replay.timestamps[0], replay.timestamps[-1] + tick, tick)
+    snapshot = np.searchsorted(replay.timestamps, ticks, side="right") - 1
+    base = np.stack([replay.targets[strategy] for strategy in strategies])     # (strategy, snapshot)
+
+    strategy = params["strategy"]
+    max_increase = params["max_increase"]
+    min_add = params["min_add"]
+    decrease_cooldown = params["decrease_cooldown"]
+    increase_interval = params["increase_interval"]
+
+    target = np.round(base[strategy, 0] + min_add, 4)
+    price = target.copy()
+    last_decreased = np.full(count, -np.inf)
+    last_increased = np.full(count, -np.inf)
+    filled_time = np.zeros(count)
+    paid = np.zeros(count)
+    current = 0
+    for t, k in zip(ticks, snapshot):
+        if k != current:
+            current = k
+            target = np.round(base[strategy, k] + min_add, 4)
+
+        decrease = (price - target >= decrease_step - PRICE_EPSILON) & (t >= last_decreased + decrease_cooldown)
+        price = np.where(decrease, np.round(price - decrease_step, 8), price)
+        last_decreased = np.where(decrease, t, last_decreased)
+
+        increase = (target - price > PRICE_EPSILON) & (t >= last_increased + increase_interval)
+        price = np.where(increase, np.round(np.minimum(price + max_increase, target), 8), price)
+        last_increased = np.where(increase, t, last_increased)
+
+        filled = price >= replay.floor[k] - PRICE_EPSILON
+        filled_time += filled * tick
+        paid += np.where(filled, price, 0.0) * tick
+
+    duration = ticks.size * tick
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_price = np.where(filled_time > 0, paid / filled_time, np.nan)
+    return {
+        "avg_price": avg_price,
+        "hashrate": limit_speed * filled_time / duration,
+        "unfilled": duration - filled_time,
+    }
+
+
+def printRow(name, strategy, max_increase, min_add, decrease_cooldown, increase_interval, avg_price, hashrate, unfilled):
+    print("  {} {} {} {} {} {} {} {} {}".format(
+            name.ljust(8),
+            strategy.ljust(14),
+            "{:.4f}".format(max_increase).rjust(8),
+            "{:.4f}".format(min_add).rjust(8),
+            "{:g}".format(decrease_cooldown / 60.0).rjust(8),
+            "{:g}".format(increase_interval / 60.0).rjust(8),
+            "{:.5f}".format(avg_price).rjust(10),
+            "{:.6f}".format(hashrate).rjust(10),
+            "{:.1f}".format(unfilled / 3600.0).rjust(10),
+        ))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Backtest order pricing parameters against the market history")
+    parser.add_argument("--history", default="market_history", help="market history directory (HISTORY_DIR)")
+    parser.add_argument("--location", type=int, default=0)
+    parser.add_argument("--algo", type=int, default=38)
+    parser.add_argument("--days", type=float, default=14, help="days of history to replay, up to now")
+    parser.add_argument("--strategy", default="minimum", help="target strategies, e.g. minimum,percentile:10,depth:0.5")
+    parser.add_argument("--max-increase", default="0.0001,0.0002,0.0005")
+    parser.add_argument("--min-add", default="0,0.0001")
+    parser.add_argument("--decrease-cooldown", default="10", help="minutes between price decreases")
+    parser.add_argument("--increase-interval", default="1", help="minutes between price increases")
+    parser.add_argument("--limit-speed", type=float, default=0.01, help="speed limit of the simulated order")
+    parser.add_argument("--tick", type=float, default=60, help="seconds per simulation step")
+    parser.add_argument("--max-unfilled", type=float, default=0.05, help="fraction of time a combination may go unfilled")
+    parser.add_argument("--top", type=int, default=20, help="combinations to list")
+    args = parser.parse_args(argv)
+
+    def floats(text):
+        return [float(value) for value in text.split(",")]
+    strategies = [parseStrategy(text) for text in args.strategy.split(",")]
+    max_increases = floats(args.max_increase)
+    min_adds = floats(args.min_add)
+    # The PRICE_ADJUST_RATE presets are always included, for comparison
+    for preset_increase, preset_add in nicehash.PRICE_ADJUST_RATES.values():
+        if preset_increase not in max_increases:
+            max_increases.append(preset_increase)
+        if preset_add not in min_adds:
+            min_adds.append(preset_add)
+    params = grid(strategies, max_increases, min_adds,
+                  [60 * value for value in floats(args.decrease_cooldown)],
+                  [60 * value for value in floats(args.increase_interval)])
+
+    start = time.perf_counter()
+    end_time = time.time()
+    data = HistorySlice.concat(MarketHistory(args.history).query(end_time - args.days * 86400, end_time))
+    replay = Replay.from_history(data.market(args.location, args.algo), strategies)
+    if len(replay) == 0:
+        print("No order books of location {} algo {} in {}".format(args.location, args.algo, args.history))
+        return 1
+    loaded = time.perf_counter()
+    results = backtest(replay, strategies, params, args.tick, args.limit_speed)
+    finished = time.perf_counter()
+
+    print("##  Backtest: {} snapshots over {:.1f} days, {} combinations".format(
+            len(replay), (replay.timestamps[-1] - replay.timestamps[0]) / 86400.0, params["strategy"].size))
+    print("##  Loaded in {:.2f}s, replayed in {:.2f}s".format(loaded - start, finished - loaded))
+    print("#   Rate     | Strategy      | Max Inc | Min Add | Dec min | Inc min | Avg Price | Hashrate | Unfilled h")
+    print("  -----------|---------------|---------|---------|---------|---------|-----------|----------|-----------")
+
+    def row(name, i):
+        printRow(name, strategyName(strategies[params["strategy"][i]]), params["max_increase"][i], params["min_add"][i],
+                 params["decrease_cooldown"][i], params["increase_interval"][i], results["avg_price"][i], results["hashrate"][i], results["unfilled"][i])
+
+    # The presets, with the first cooldown and interval given
+    for rate, (preset_increase, preset_add) in nicehash.PRICE_ADJUST_RATES.items():
+        for i in np.flatnonzero((params["max_increase"] == preset_increase) & (params["min_add"] == preset_add)
+                                & (params["decrease_cooldown"] == params["decrease_cooldown"][0])
+                                & (params["increase_interval"] == params["increase_interval"][0])):
+            row(rate, i)
+
+    # The cheapest combinations that stay filled long enough
+    duration = replay.timestamps[-1] - replay.timestamps[0] + args.tick
+    eligible = np.flatnonzero(results["unfilled"] <= args.max_unfilled * duration)
+    ranked = eligible[np.argsort(results["avg_price"][eligible], kind="stable")]
+    print("  -----------|---------------|---------|---------|---------|---------|-----------|----------|-----------")
+    for i in ranked[:args.top]:
+        row("", i)
+    if ranked.size == 0:
+        print("  No combination was filled for {:.0%} of the time".format(1 - args.max_unfilled))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
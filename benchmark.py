@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# End to end benchmarks of the control loop against mockserver.py.
+# Reports loop wall time, API calls per loop and peak memory for each
+# order book size and injected latency.
+#
+#   ./benchmark.py --sizes 100,1000,10000,100000 --latency 0,0.05 --loops 3
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+import mockserver
+import nicehash
+import mwgrinpool
+
+
+MOCK_WALLET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock")
+
+
+# Run updateOrders against the mock server with a fresh client. Returns a list of per loop results.
+def benchNicehash(server, workdir, loops, use_cache=False, use_history=False):
+    results = []
+    state_db = os.path.join(workdir, "nicehash_state.db")
+    registry_file = os.path.join(workdir, "nicehash_registry.json")
+    for path in [state_db, state_db + "-wal", state_db + "-shm", registry_file]:
+        if os.path.exists(path):
+            os.remove(path)
+    client = nicehash.NicehashClient("mock", "mock", api_url=server.url + "/api",
+            rate_limit=1000000, rate_burst=1000000, state_db=state_db,
+            registry_file=registry_file,
+            history_dir=os.path.join(workdir, "market_history") if use_history else None)
+    for i in range(loops):
+        if not use_cache:
+            client.order_book_cache.invalidate()
+        server.state.reset()
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.updateOrders()
+        wall = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({
+            "wall": wall,
+            "calls": server.state.stats()["total"],
+            "peak_mb": peak / 1048576.0,
+        })
+    client.close()
+    return results
+
+
+# Run one pool payout with the fake grin-wallet. Returns the result.
+def benchPayout(server):
+    server.state.reset()
+    server.state.setBalance(0.5)
+    payout = mwgrinpool.Pool_Payout()
+    payout.mwURL = server.url
+    payout.username = "mock"
+    payout.password = "mock"
+    payout.wallet_pass = "mock"
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        payout.output = sys.stdout
+        result = payout.run_local_wallet()
+    ok = result.status == mwgrinpool.PAID
+    wall = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall": wall,
+        "calls": server.state.stats()["total"],
+        "peak_mb": peak / 1048576.0,
+        "ok": ok,
+    }
+
+
+def printRow(name, size, latency, result):
+    print("  {} {} {} {} {} {}".format(
+            name.ljust(10),
+            str(size).rjust(8),
+            "{:.3f}".format(latency).rjust(8),
+            "{:.3f}".format(result["wall"]).rjust(9),
+            str(result["calls"]).rjust(6),
+            "{:.1f}".format(result["peak_mb"]).rjust(9),
+        ))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the Hash Manager control loop against local mock services")
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="orders per market order book")
+    parser.add_argument("--latency", default="0", help="seconds of latency injected per request")
+    parser.add_argument("--loops", type=int, default=3, help="control loops per size")
+    parser.add_argument("--my-orders", type=int, default=1, help="our orders per market")
+    parser.add_argument("--cache", action="store_true", help="keep order book snapshots cached between loops")
+    parser.add_argument("--history", action="store_true", help="record order book snapshots in the market history")
+    parser.add_argument("--no-payout", action="store_true", help="skip the pool payout benchmark")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    latencies = [float(latency) for latency in args.latency.split(",")]
+
+    server = mockserver.MockServer().start()
+    workdir = tempfile.mkdtemp(prefix="hashmanager-bench-")
+    os.environ["PATH"] = MOCK_WALLET_DIR + os.pathsep + os.environ.get("PATH", "")
+
+    print("##  Benchmark: {} loops per size, {} of our orders per market".format(args.loops, args.my_orders))
+    print("#   Stage    |  Orders  | Latency |  Wall s  | Calls |  Peak MB")
+    print("  -----------|----------|---------|----------|-------|----------")
+    cwd = os.getcwd()
+    try:
+        for latency in latencies:
+            server.state.latency = latency
+            for size in sizes:
+                server.state.setBookSize(size, args.my_orders)
+                for result in benchNicehash(server, workdir, args.loops, args.cache, args.history):
+                    printRow("loop", size, latency, result)
+            if not args.no_payout:
+                os.chdir(workdir)
+                result = benchPayout(server)
+                os.chdir(cwd)
+                printRow("payout" if result["ok"] else "payout!", "-", latency, result)
+    finally:
+        os.chdir(cwd)
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+from collections import OrderedDict
+
+
+# A fetch in progress. Other callers asking for the same key wait on it.
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+# Thread safe cache with a time to live and LRU eviction.
+# Concurrent misses for the same key are coalesced into a single fetch.
+class TTLCache:
+    def __init__(self, ttl, max_entries=128):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.entries = OrderedDict()    # key -> (expires, value), least recently used first
+        self.inflight = {}              # key -> _Flight
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # Return the cached value for key, calling fetch() to get it if missing or expired.
+    # Errors raised by fetch() are passed on to every waiting caller and not cached.
+    def get(self, key, fetch):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            flight = self.inflight.get(key)
+            if flight is None:
+                self.misses += 1
+                flight = _Flight()
+                self.inflight[key] = flight
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            with self.lock:
+                self.entries[key] = (time.monotonic() + self.ttl, flight.value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return flight.value
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            flight.event.set()
+
+    # Drop one key, or everything
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "size": len(self.entries),
+            }
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+from ratelimit import TokenBucket
+import metrics
+
+
+POLL_INTERVAL = metrics.gauge("nicehash_poll_interval_seconds", "Current polling interval of each market", ["location", "algo"])
+POLLS_DEFERRED = metrics.counter("nicehash_polls_deferred_total", "Market polls put off because the API call budget ran out")
+
+
+# Polling state of one market
+class MarketCadence:
+    __slots__ = ["interval", "next_poll", "last_target", "last_floor"]
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_poll = 0.0
+        self.last_target = None
+        self.last_floor = None
+
+
+# Decides which markets to poll, each on its own cadence.
+# A market that moved since its last poll is polled again after min_interval; a quiet
+# one backs off by a factor of backoff each poll, up to max_interval. Polls share a
+# budget of calls_per_hour API calls, each poll costing calls_per_poll of them.
+class AdaptivePoller:
+    def __init__(self, min_interval, max_interval, backoff=1.5, calls_per_hour=600, calls_per_poll=2):
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.backoff = max(1.0, float(backoff))
+        self.calls_per_poll = calls_per_poll
+        self.budget = TokenBucket(calls_per_hour / 3600.0, max(calls_per_poll, calls_per_hour // 60))
+        self.markets = {}       # (location, algo) -> MarketCadence
+        self.lock = threading.Lock()
+
+    def __cadence(self, market):
+        cadence = self.markets.get(market)
+        if cadence is None:
+            cadence = self.markets[market] = MarketCadence(self.min_interval)
+        return cadence
+
+    # The markets to poll now, most overdue first, as far as the budget allows.
+    # Markets left over stay due and are polled on a later call.
+    def due(self, markets, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            waiting = sorted((self.__cadence(market).next_poll, market) for market in markets)
+            overdue = [market for next_poll, market in waiting if next_poll <= now]
+            polls = []
+            for market in overdue:
+                if self.budget.try_acquire(self.calls_per_poll) > 0:
+                    POLLS_DEFERRED.inc(len(overdue) - len(polls))
+                    break
+                polls.append(market)
+            return polls
+
+    # Take calls API calls made outside of market polls from the budget.
+    # Returns False, taking nothing, if the budget doesn't have them now.
+    def spend(self, calls):
+        return self.budget.try_acquire(calls) <= 0
+
+    # Record the result of polling a market. moved is True when something beyond the
+    # prices changed, such as our orders losing workers. Returns the next interval.
+    def observe(self, market, target, floor, moved=False, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            cadence = self.__cadence(market)
+            for last, value in [(cadence.last_target, target), (cadence.last_floor, floor)]:
+                if last is None or value is None or abs(value - last) > 0.00000001:
+                    moved = True
+            if moved:
+                cadence.interval = self.min_interval
+            else:
+                cadence.interval = min(self.max_interval, cadence.interval * self.backoff)
+            cadence.last_target = target
+            cadence.last_floor = floor
+            cadence.next_poll = now + cadence.interval
+            POLL_INTERVAL.labels(location=market[0], algo=market[1]).set(cadence.interval)
+            return cadence.interval
+
+    # Time the next market is due
+    def nextDue(self):
+        with self.lock:
+            return min([cadence.next_poll for cadence in self.markets.values()], default=0.0)
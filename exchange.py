@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import httpclient
+
+
+# Status of a deposit, sale or withdrawal
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class ExchangeError(Exception):
+    pass
+
+
+# What an exchange adapter provides. Each call returns quickly; the funding
+# pipeline polls the status calls until the operation is DONE or FAILED.
+class Exchange:
+    name = None
+
+    # Send amount GRIN to the exchange. Returns a deposit id.
+    def deposit(self, amount):
+        raise NotImplementedError
+
+    # (status, GRIN credited)
+    def depositStatus(self, deposit_id):
+        raise NotImplementedError
+
+    # Sell amount GRIN for BTC at market. Returns an order id.
+    def sell(self, amount):
+        raise NotImplementedError
+
+    # (status, BTC received)
+    def saleStatus(self, order_id):
+        raise NotImplementedError
+
+    # Withdraw amount BTC to address. Returns a withdrawal id.
+    def withdraw(self, amount, address):
+        raise NotImplementedError
+
+    # (status, BTC sent after fees)
+    def withdrawalStatus(self, withdrawal_id):
+        raise NotImplementedError
+
+
+# The exchange served by mockserver.py
+class MockExchange(Exchange):
+    name = "mock"
+
+    def __init__(self, url, api_key=""):
+        self.url = url.rstrip("/") + "/exchange"
+        self.api_key = api_key
+
+    def __call(self, method, path, body=None):
+        try:
+            r = httpclient.request(method, self.url + path, json=body, headers={"X-Api-Key": self.api_key})
+        except Exception as e:
+            raise ExchangeError("Exchange request {} failed: {}".format(path, str(e)))
+        if r.status_code != 200:
+            raise ExchangeError("Exchange request {} failed with status {}: {}".format(path, r.status_code, r.text))
+        return r.json()
+
+    def deposit(self, amount):
+        return self.__call("POST", "/deposit", {"amount": amount})["id"]
+
+    def depositStatus(self, deposit_id):
+        result = self.__call("GET", "/deposit/{}".format(deposit_id))
+        return result["status"], result["amount"]
+
+    def sell(self, amount):
+        return self.__call("POST", "/sell", {"amount": amount})["id"]
+
+    def saleStatus(self, order_id):
+        result = self.__call("GET", "/sell/{}".format(order_id))
+        return result["status"], result["btc"]
+
+    def withdraw(self, amount, address):
+        return self.__call("POST", "/withdraw", {"amount": amount, "address": address})["id"]
+
+    def withdrawalStatus(self, withdrawal_id):
+        result = self.__call("GET", "/withdraw/{}".format(withdrawal_id))
+        return result["status"], result["amount"]
+
+
+# Exchange adapters by name, as used in the [funding] EXCHANGE setting
+ADAPTERS = {
+    MockExchange.name: MockExchange,
+}
+
+
+# Build the adapter named in a [funding] config section
+def fromConfig(config):
+    name = config.get('EXCHANGE', "mock")
+    if name not in ADAPTERS:
+        raise ExchangeError("Unknown exchange \"{}\", expected one of {}".format(name, ", ".join(ADAPTERS)))
+    return ADAPTERS[name](config['EXCHANGE_URL'], config.get('EXCHANGE_API_KEY', ""))
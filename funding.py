@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+import metrics
+import exchange
+from pipeline import Pipeline, Stage
+
+
+FUNDING_RESULTS = metrics.counter("funding_results_total", "Pool payouts that finished the funding pipeline", ["status"])
+FUNDED_BTC = metrics.counter("funding_btc_total", "BTC sent to NiceHash by the funding pipeline")
+
+
+# One pool payout on its way to NiceHash
+class Funding:
+    __slots__ = ["username", "grin", "deposit_id", "sale_id", "btc", "withdrawal_id", "sent", "status", "error"]
+
+    def __init__(self, username, grin):
+        self.username = username
+        self.grin = grin                # GRIN paid out by the pool
+        self.deposit_id = None
+        self.sale_id = None
+        self.btc = None                 # BTC the sale brought
+        self.withdrawal_id = None
+        self.sent = None                # BTC that reached NiceHash, after fees
+        self.status = exchange.PENDING
+        self.error = None
+
+
+# Moves pool payouts to NiceHash in stages: deposit GRIN to the exchange, sell it
+# for BTC, withdraw the BTC to NiceHash and (optionally) add it to an order.
+# Each stage works on its own payout, so a new payout can be deposited while an
+# earlier one is still being sold or withdrawn.
+#   exchange:       an exchange.Exchange adapter
+#   address:        NiceHash BTC deposit address
+#   refill:         refill(amount) adds BTC to a NiceHash order, or None to leave it in the balance
+#   poll_interval:  seconds between status checks of a pending operation
+#   timeout:        seconds an operation may stay pending before the payout fails
+#   close_timeout:  seconds close() waits for the payouts in the pipeline
+class FundingPipeline:
+    def __init__(self, exchange, address, refill=None, queue_size=4, poll_interval=30.0, timeout=7200.0,
+                 close_timeout=60.0):
+        self.exchange = exchange
+        self.address = address
+        self.refill = refill
+        self.poll_interval = float(poll_interval)
+        self.timeout = float(timeout)
+        self.close_timeout = float(close_timeout)
+        self.in_flight = []     # Payouts submitted that haven't finished or failed
+        self.lock = threading.Lock()
+        stages = [
+            Stage("deposit", self.__deposit),
+            Stage("exchange", self.__sell),
+            Stage("withdraw", self.__withdraw),
+        ]
+        if refill is not None:
+            stages.append(Stage("refill", self.__refill))
+        self.pipeline = Pipeline("funding", stages, queue_size, self.__done, self.__failed)
+
+    # Build the pipeline from the [funding] section of config.toml
+    @classmethod
+    def from_config(cls, config, refill=None):
+        return cls(
+                exchange.fromConfig(config),
+                config['NICEHASH_BTC_ADDRESS'],
+                refill=refill,
+                queue_size=config.get('QUEUE_SIZE', 4),
+                poll_interval=config.get('POLL_SECONDS', 30),
+                timeout=60 * config.get('CONFIRM_TIMEOUT_MINUTES', 120),
+                close_timeout=config.get('CLOSE_TIMEOUT_SECONDS', 60),
+            )
+
+    # Poll status() until it is no longer pending. Returns the amount it reports.
+    def __wait(self, what, status):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            state, amount = status()
+            if state == exchange.DONE:
+                return amount
+            if state == exchange.FAILED:
+                raise exchange.ExchangeError("{} failed".format(what))
+            if time.monotonic() >= deadline:
+                raise exchange.ExchangeError("{} still pending after {:.0f} seconds".format(what, self.timeout))
+            time.sleep(self.poll_interval)
+
+    def __deposit(self, funding):
+        funding.deposit_id = self.exchange.deposit(funding.grin)
+        funding.grin = self.__wait("Deposit {}".format(funding.deposit_id),
+                lambda: self.exchange.depositStatus(funding.deposit_id))
+        return funding
+
+    def __sell(self, funding):
+        funding.sale_id = self.exchange.sell(funding.grin)
+        funding.btc = self.__wait("Sale {}".format(funding.sale_id),
+                lambda: self.exchange.saleStatus(funding.sale_id))
+        return funding
+
+    def __withdraw(self, funding):
+        funding.withdrawal_id = self.exchange.withdraw(funding.btc, self.address)
+        funding.sent = self.__wait("Withdrawal {}".format(funding.withdrawal_id),
+                lambda: self.exchange.withdrawalStatus(funding.withdrawal_id))
+        return funding
+
+    def __refill(self, funding):
+        self.refill(funding.sent)
+        return funding
+
+    def __done(self, funding):
+        funding.status = exchange.DONE
+        FUNDING_RESULTS.labels(status=funding.status).inc()
+        FUNDED_BTC.inc(funding.sent)
+        print("Funding: {} GRIN from {} reached NiceHash as {} BTC".format(funding.grin, funding.username, funding.sent))
+        with self.lock:
+            self.in_flight.remove(funding)
+
+    def __failed(self, funding, stage, error):
+        funding.status = exchange.FAILED
+        funding.error = "{}: {}".format(stage, str(error))
+        FUNDING_RESULTS.labels(status=funding.status).inc()
+        print("Error: Funding of {} GRIN from {} failed at {}".format(funding.grin, funding.username, funding.error))
+        with self.lock:
+            self.in_flight.remove(funding)
+
+    # Queue a pool payout of grin GRIN. Blocks while the deposit stage is backed up.
+    def submit(self, username, grin, timeout=None):
+        funding = Funding(username, grin)
+        with self.lock:
+            self.in_flight.append(funding)
+        if not self.pipeline.submit(funding, timeout):
+            with self.lock:
+                self.in_flight.remove(funding)
+            return False
+        return True
+
+    # Wait up to close_timeout seconds for the payouts in the pipeline to finish.
+    # Those still going are listed with their exchange ids, to be finished by hand.
+    def close(self):
+        if self.pipeline.close(self.close_timeout):
+            return True
+        with self.lock:
+            in_flight = list(self.in_flight)
+        for funding in in_flight:
+            print("Error: Funding of {} GRIN from {} left unfinished: deposit {}, sale {}, withdrawal {}".format(
+                    funding.grin, funding.username, funding.deposit_id, funding.sale_id, funding.withdrawal_id))
+        return False
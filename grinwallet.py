@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Grin wallet backends.
+#   CliWallet:   runs the grin-wallet command for every operation
+#   RpcWallet:   keeps one `grin-wallet listen` process running and talks to it over
+#                the foreign JSON-RPC API (and to an owner_api, if one is configured)
+#   Wallet:      RpcWallet, falling back to CliWallet when the RPC path fails
+
+import os
+import json
+import time
+import atexit
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import httpclient
+import profiling
+
+
+class WalletError(Exception):
+    pass
+
+
+# Slate files for the command line wallet go to tmpfs when there is one, to avoid disk writes
+SLATE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+__found = {}        # (PATH, cwd) -> wallet command
+__find_lock = threading.Lock()
+
+
+# Find the wallets executable, from the path, cwd, and build directories.
+# The result is cached per PATH and cwd. Returns the command as a list, or None.
+def findWallet(refresh=False):
+    cwd = os.getcwd()
+    path = os.environ.get('PATH', "")
+    key = (path, cwd)
+    with __find_lock:
+        if not refresh and key in __found:
+            return __found[key]
+
+    path_add = [
+        path,
+        cwd,
+        cwd + "/grin",
+        cwd + "/grin/target/debug",
+        cwd + "/grin/target/release",
+        cwd + "/grin-wallet",
+        cwd + "/grin-wallet/target/debug",
+        cwd + "/grin-wallet/target/release",
+    ]
+    directories = ":".join(path_add).split(":")
+    # Later directories win, so local builds override the PATH
+    grin_wallet_cmd = None
+    for directory in directories:
+        if os.path.isfile(directory + "/grin-wallet"):
+            grin_wallet_cmd = [directory + "/grin-wallet"]
+        elif os.path.isfile(directory + "/grin-wallet.exe"):
+            grin_wallet_cmd = [directory + "/grin-wallet.exe"]
+    if grin_wallet_cmd is None:
+        for directory in directories:
+            if os.path.isfile(directory + "/grin"):
+                grin_wallet_cmd = [directory + "/grin", "wallet"]
+            elif os.path.isfile(directory + "/grin.exe"):
+                grin_wallet_cmd = [directory + "/grin.exe", "wallet"]
+
+    with __find_lock:
+        if grin_wallet_cmd is not None:
+            __found[key] = grin_wallet_cmd
+        return grin_wallet_cmd
+
+
+# Runs the wallet command line for every operation
+class CliWallet:
+    def __init__(self, cmd, password):
+        self.cmd = cmd
+        self.password = password
+
+    def __run(self, args):
+        try:
+            with profiling.span("wallet.cli." + args[0]):
+                return subprocess.check_output(self.cmd + ["-p", self.password] + args, stderr=subprocess.STDOUT, shell=False)
+        except subprocess.CalledProcessError as exc:
+            raise WalletError("Wallet {} failed with output: {}".format(args[0], exc.output.decode("utf-8")))
+        except Exception as e:
+            raise WalletError("Wallet {} failed with error: {}".format(args[0], str(e)))
+
+    # Wallet sanity check
+    def info(self):
+        return self.__run(["info"]).decode("utf-8")
+
+    # Receive and sign a slate. Returns the signed slate.
+    # The wallet only reads slates from files, so they go through a private temporary directory.
+    def receive(self, slate):
+        directory = tempfile.mkdtemp(prefix="grin-slate-", dir=SLATE_DIR)
+        try:
+            filename = os.path.join(directory, "slate.json")
+            with open(filename, "w") as f:
+                f.write(slate)
+            self.__run(["receive", "-i", filename])
+            with open(filename + ".response", "r") as f:
+                return f.read()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def close(self):
+        pass
+
+
+# Talks to one long-lived wallet listener over the JSON-RPC API
+class RpcWallet:
+    def __init__(self, cmd, password, host="127.0.0.1", listen_port=3415, foreign_secret=None,
+                 owner_url=None, owner_secret=None, startup_timeout=30.0, spawn=True):
+        self.cmd = cmd
+        self.password = password
+        self.host = host
+        self.listen_port = int(listen_port)
+        self.foreign_url = "http://{}:{}/v2/foreign".format(host, self.listen_port)
+        self.foreign_secret = foreign_secret or None
+        self.owner_url = owner_url or None
+        self.owner_secret = owner_secret or None
+        self.startup_timeout = startup_timeout
+        self.spawn = spawn
+        self.process = None
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def __listening(self):
+        try:
+            with socket.create_connection((self.host, self.listen_port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    # Start the listener, unless one is already running
+    def start(self):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+            if self.__listening():
+                return
+            if not self.spawn:
+                raise WalletError("No wallet listening on {}:{}".format(self.host, self.listen_port))
+            self.process = subprocess.Popen(
+                    self.cmd + ["-p", self.password, "listen", "-l", str(self.listen_port)],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+            deadline = time.monotonic() + self.startup_timeout
+            while not self.__listening():
+                if self.process.poll() is not None:
+                    self.process = None
+                    raise WalletError("Wallet listener exited during startup")
+                if time.monotonic() > deadline:
+                    self.__terminate()
+                    raise WalletError("Wallet listener did not start within {} seconds".format(self.startup_timeout))
+                time.sleep(0.1)
+
+    def __terminate(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def close(self):
+        with self.lock:
+            self.__terminate()
+
+    def __call(self, url, secret, method, params):
+        with self.lock:
+            self.next_id += 1
+            request_id = self.next_id
+        auth = ("grin", secret) if secret else None
+        try:
+            with profiling.span("wallet.rpc." + method):
+                r = httpclient.post(url, json={"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}, auth=auth)
+        except Exception as e:
+            raise WalletError("Wallet {} request failed: {}".format(method, str(e)))
+        if r.status_code != 200:
+            raise WalletError("Wallet {} failed with status {}: {}".format(method, r.status_code, r.text))
+        response = r.json()
+        if "error" in response:
+            raise WalletError("Wallet {} failed: {}".format(method, response["error"]))
+        result = response.get("result")
+        if isinstance(result, dict) and "Err" in result:
+            raise WalletError("Wallet {} failed: {}".format(method, result["Err"]))
+        if isinstance(result, dict) and "Ok" in result:
+            return result["Ok"]
+        return result
+
+    def foreign(self, method, params):
+        self.start()
+        return self.__call(self.foreign_url, self.foreign_secret, method, params)
+
+    def owner(self, method, params):
+        if self.owner_url is None:
+            raise WalletError("No wallet owner API configured")
+        return self.__call(self.owner_url, self.owner_secret, method, params)
+
+    # Wallet sanity check
+    def info(self):
+        if self.owner_url is not None:
+            return json.dumps(self.owner("retrieve_summary_info", [True, 10]))
+        return json.dumps(self.foreign("check_version", []))
+
+    # Receive and sign a slate. Returns the signed slate.
+    def receive(self, slate):
+        signed = self.foreign("receive_tx", [json.loads(slate), None, None])
+        return json.dumps(signed)
+
+
+# Prefers the RPC wallet, and falls back to the command line when it fails.
+# Slates are signed one at a time; pass the same lock to wallets sharing a wallet directory.
+class Wallet:
+    def __init__(self, cmd, password, backend="rpc", lock=None, **rpc_options):
+        self.cli = CliWallet(cmd, password)
+        self.rpc = RpcWallet(cmd, password, **rpc_options) if backend == "rpc" else None
+        self.lock = lock if lock is not None else threading.Lock()
+
+    def __fallback(self, operation, *args):
+        if self.rpc is not None:
+            try:
+                return getattr(self.rpc, operation)(*args)
+            except WalletError as e:
+                print("Wallet RPC {} failed, using the command line: {}".format(operation, str(e)))
+        return getattr(self.cli, operation)(*args)
+
+    def info(self):
+        return self.__fallback("info")
+
+    def receive(self, slate):
+        with self.lock:
+            return self.__fallback("receive", slate)
+
+    def close(self):
+        if self.rpc is not None:
+            self.rpc.close()
+
+
+__wallets = {}      # (cmd, password, backend, options) -> Wallet
+__signing_locks = {}    # (cmd, listen port) -> lock shared by every Wallet for that wallet
+__wallets_lock = threading.Lock()
+
+
+# A shared wallet, so the listener process outlives each payout
+def getWallet(password, backend="rpc", refresh=False, **rpc_options):
+    cmd = findWallet(refresh)
+    if cmd is None:
+        raise WalletError("Could not find wallet executable, please add it to your PATH or copy it into this directory.")
+    key = (tuple(cmd), password, backend, tuple(sorted(rpc_options.items())))
+    with __wallets_lock:
+        wallet = __wallets.get(key)
+        if wallet is None:
+            lock = __signing_locks.setdefault((tuple(cmd), rpc_options.get("listen_port")), threading.Lock())
+            wallet = __wallets[key] = Wallet(cmd, password, backend, lock, **rpc_options)
+        return wallet
+
+
+@atexit.register
+def __closeWallets():
+    with __wallets_lock:
+        for wallet in __wallets.values():
+            wallet.close()
+        __wallets.clear()
@@ -14,59 +14,134 @@
 # limitations under the License.
 
 
-import os
 import sys
-import time
+import asyncio
+import argparse
 import toml
+import httpclient
+import metrics
+import scheduler
 import nicehash
 import mwgrinpool
-
-
-def __updateNicehashOrders():
-    nicehash.updateOrders()
-
-def __withdrawFromPool(config):
-    payout = mwgrinpool.Pool_Payout()
-    payout.username = config['USERNAME']
-    payout.password = config['PASSWORD']
-    payout.wallet_pass = config['PASSWORD']
-    payout.run_local_wallet()
+import payoutmanager
+import funding
+import profiling
+
+
+def __updateNicehashOrders(client):
+    client.updateOrders()
+
+def __withdrawFromPool(config, funding_pipeline=None):
+    results = payoutmanager.PayoutManager.from_config(config).run()
+    for result in results:
+        print("Pool payout {}: {}{}".format(result.username, result.status,
+                "" if result.message is None else " - {}".format(result.message)))
+        # Hand the GRIN on to the funding pipeline. This waits only while its deposit stage is backed up.
+        if funding_pipeline is not None and result.status in [mwgrinpool.PAID, mwgrinpool.RESUMED] and result.amount:
+            funding_pipeline.submit(result.username, result.amount)
+
+
+# Build a scheduler task from its [hashmanager.tasks.<name>] config section
+def __task(config, name, func):
+    defaults = config['hashmanager']
+    task_config = defaults.get('tasks', {}).get(name, {})
+    if not task_config.get('ENABLED', True):
+        return None
+    timeout = task_config.get('TIMEOUT_MINUTES')
+    return scheduler.Task(
+            name,
+            func,
+            interval=60 * task_config.get('INTERVAL_MINUTES', defaults['LOOP_DELAY_MINUTES']),
+            jitter=task_config.get('JITTER_SECONDS', 0),
+            timeout=None if timeout is None else 60 * timeout,
+            overlap=task_config.get('OVERLAP', scheduler.OVERLAP_SKIP),
+            delay=task_config.get('DELAY_SECONDS', 0),
+        )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage Nicehash orders and pool payouts")
+    parser.add_argument("--profile", nargs="?", const="profile", metavar="DIR",
+            help="profile every task run, dumping to DIR (default: profile). Task runs go one at a time")
+    parser.add_argument("--profile-keep", type=int, default=20, metavar="N",
+            help="profile dumps kept for each task (default: 20)")
+    parser.add_argument("--profile-top", type=int, default=20, metavar="N",
+            help="hot spots listed in the profile summary at exit (default: 20)")
+    args = parser.parse_args()
+
     ## Load user config
     config = toml.load("config.toml")
-    LOOP_DELAY_MINUTES = 60 * config['hashmanager']['LOOP_DELAY_MINUTES']
+    httpclient.configure(config.get('http'))
+
+    ## Start the metrics endpoint
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('ENABLED', False):
+        metrics.startServer(metrics_config.get('PORT', 9105), metrics_config.get('ADDRESS', "127.0.0.1"))
+
+    ## Nicehash client
+    try:
+        nicehash_client = nicehash.NicehashClient.from_config(config['nicehash'])
+    except nicehash.ConfigError as e:
+        print("Error:  {}".format(str(e)))
+        print("  ")
+        sys.exit(1)
+
+    ## Funding pipeline: deposit pool payouts to the exchange, sell them for BTC,
+    ## withdraw the BTC to Nicehash and add it to an order. Runs beside the other tasks.
+    funding_pipeline = None
+    funding_config = config.get('funding', {})
+    if funding_config.get('ENABLED', False):
+        refill = None
+        refill_order = funding_config.get('REFILL_ORDER', 0)
+        if refill_order:
+            refill = lambda amount: nicehash_client.refillOrder(refill_order, amount)
+        try:
+            funding_pipeline = funding.FundingPipeline.from_config(funding_config, refill)
+        except (funding.exchange.ExchangeError, KeyError) as e:
+            print("Error:  Bad [funding] config: {}".format(str(e)))
+            print("  ")
+            sys.exit(1)
 
     ## Print banner
     print("################################################################################")
     print("##                                Hash Manager                                ##")
     print("################################################################################")
 
-
-    while(1):
-        ## Open new Nicehash orders
-        # Any BTC funds sitting in Nicehash should be committed to hash orders.
-
-        ## Update existing Nicehash orders
-        # Existing orders should be updated to track lowest possible price
-        try:
-            print("Updating existing Nicehash orders...")
-            __updateNicehashOrders()
-        except Exception as e:
-            print("Error: {}".format(str(e)))
-
-        ## Withdraw from mining pool
-        try:
-            __withdrawFromPool(config['mwgrinpool'])
-        except Exception as e:
-            print("Error: {}".format(str(e)))
-
-        ## Deposit GRIN to exchange
-
-        ## Exchange funds for BTC
-
-        ## Withdraw BTC to Nicehash
-
-        ## Sleep
-        time.sleep(LOOP_DELAY_MINUTES)
+    ## Schedule tasks. Each runs on its own cadence, independent tasks concurrently.
+    tasks = scheduler.Scheduler()
+
+    ## Update existing Nicehash orders
+    # Existing orders should be updated to track lowest possible price
+    def update_orders():
+        print("Updating existing Nicehash orders...")
+        __updateNicehashOrders(nicehash_client)
+
+    ## Withdraw from mining pool
+    def pool_payout():
+        __withdrawFromPool(config, funding_pipeline)
+
+    ## Profile each task run: cProfile, memory and the time spent in each phase
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.Profiler(args.profile, args.profile_keep)
+        print("Profiling task runs to {}".format(args.profile))
+
+    for name, func in [("update_orders", update_orders), ("pool_payout", pool_payout)]:
+        if profiler is not None:
+            func = lambda name=name, func=func: profiler.run(name, func)
+        task = __task(config, name, func)
+        if task is not None:
+            tasks.add(task)
+
+    try:
+        asyncio.run(tasks.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if funding_pipeline is not None:
+            print("Waiting up to {:.0f} seconds for payouts in the funding pipeline to finish...".format(
+                    funding_pipeline.close_timeout))
+            funding_pipeline.close()
+        nicehash_client.close()
+        if profiler is not None:
+            profiling.summarize(args.profile, args.profile_top)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import time
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from pricing import OrderBook
+
+
+# Columns of the history, in the order they are written, and their on disk types.
+# One row is one order of one order book snapshot: 32 bytes.
+COLUMNS = [
+    ("timestamp", np.float64),
+    ("location", np.uint8),
+    ("algo", np.uint16),
+    ("price", np.float64),
+    ("limit_speed", np.float32),
+    ("accepted_speed", np.float32),
+    ("workers", np.uint32),
+    ("type", np.int8),
+]
+
+SEGMENT_FORMAT = "%Y-%m-%d"     # One segment directory per UTC day
+
+
+def _segmentName(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(SEGMENT_FORMAT)
+
+
+# Rows of the history, as column arrays. Slices of a segment are views of its memmaps.
+class HistorySlice:
+    def __init__(self, columns):
+        self.columns = columns
+        for name, dtype in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return self.timestamp.size
+
+    # Join slices into one, copying them
+    @classmethod
+    def concat(cls, slices):
+        slices = list(slices)
+        if not slices:
+            return cls({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS})
+        return cls({name: np.concatenate([s.columns[name] for s in slices]) for name, dtype in COLUMNS})
+
+    # The rows of one market, copied
+    def market(self, location, algo):
+        mask = (self.location == location) & (self.algo == algo)
+        return HistorySlice({name: self.columns[name][mask] for name, dtype in COLUMNS})
+
+    # Each order book snapshot in the slice. Yields (timestamp, location, algo, OrderBook),
+    # where the OrderBook columns are views. Snapshots are stored as runs of rows.
+    def books(self):
+        if len(self) == 0:
+            return
+        change = ((self.timestamp[1:] != self.timestamp[:-1])
+                  | (self.location[1:] != self.location[:-1])
+                  | (self.algo[1:] != self.algo[:-1]))
+        bounds = np.concatenate(([0], np.flatnonzero(change) + 1, [len(self)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            yield (float(self.timestamp[start]), int(self.location[start]), int(self.algo[start]), OrderBook(
+                    self.price[start:end],
+                    self.limit_speed[start:end],
+                    self.accepted_speed[start:end],
+                    self.workers[start:end],
+                    self.type[start:end],
+                ))
+
+
+# Append-only columnar store of market order book snapshots.
+# Each UTC day is a segment directory holding one raw file per column. Rows are
+# only ever appended, and a segment is read back with numpy memmaps, so queries
+# don't load or copy more than the columns they touch.
+class MarketHistory:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.repaired = set()   # Segments checked for a torn append since we opened them
+        self.last_timestamp = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, segment, column):
+        return os.path.join(self.directory, segment, column + ".col")
+
+    # Rows in a segment. A crash during an append can leave columns of different
+    # lengths; only rows present in every column count.
+    def __rows(self, segment):
+        rows = None
+        for name, dtype in COLUMNS:
+            try:
+                size = os.path.getsize(self.__path(segment, name))
+            except FileNotFoundError:
+                return 0
+            count = size // np.dtype(dtype).itemsize
+            rows = count if rows is None else min(rows, count)
+        return rows or 0
+
+    # Cut every column of a segment back to the rows present in all of them
+    def __repair(self, segment):
+        rows = self.__rows(segment)
+        for name, dtype in COLUMNS:
+            path = self.__path(segment, name)
+            if os.path.exists(path) and os.path.getsize(path) != rows * np.dtype(dtype).itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+        if rows:
+            last = np.memmap(self.__path(segment, "timestamp"), dtype=np.float64, mode="r", shape=(rows,))[-1]
+            self.last_timestamp = max(self.last_timestamp, float(last))
+        self.repaired.add(segment)
+
+    # Every segment name, oldest first
+    def segments(self):
+        names = []
+        for name in os.listdir(self.directory):
+            try:
+                datetime.strptime(name, SEGMENT_FORMAT)
+            except ValueError:
+                continue
+            names.append(name)
+        return sorted(names)
+
+    # Record one order book snapshot of a market. Snapshots fetched concurrently can
+    # arrive out of order; timestamps are clamped so every segment stays sorted.
+    def append(self, location, algo, timestamp, book):
+        rows = len(book)
+        if rows == 0:
+            return 0
+        values = {
+            "location": np.full(rows, location),
+            "algo": np.full(rows, algo),
+            "price": book.price,
+            "limit_speed": book.limit_speed,
+            "accepted_speed": book.accepted_speed,
+            "workers": book.workers,
+            "type": book.type,
+        }
+        with self.lock:
+            segment = _segmentName(timestamp)
+            os.makedirs(os.path.join(self.directory, segment), exist_ok=True)
+            if segment not in self.repaired:
+                self.__repair(segment)
+            timestamp = max(timestamp, self.last_timestamp)
+            segment = _segmentName(timestamp)
+            self.last_timestamp = timestamp
+            values["timestamp"] = np.full(rows, timestamp)
+            for name, dtype in COLUMNS:
+                with open(self.__path(segment, name), "ab") as f:
+                    f.write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+        return rows
+
+    # Memory map every column of a segment
+    def __open(self, segment):
+        rows = self.__rows(segment)
+        columns = {}
+        for name, dtype in COLUMNS:
+            if rows == 0:
+                columns[name] = np.empty(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(self.__path(segment, name), dtype=dtype, mode="r", shape=(rows,))
+        return HistorySlice(columns)
+
+    # The rows with start <= timestamp < end, as one slice per segment.
+    # The slices are views of the segment memmaps; nothing is copied.
+    def query(self, start=None, end=None):
+        first = None if start is None else _segmentName(start)
+        last = None if end is None else _segmentName(end)
+        slices = []
+        for segment in self.segments():
+            if (first is not None and segment < first) or (last is not None and segment > last):
+                continue
+            data = self.__open(segment)
+            # Rows are appended in time order, so each segment is sorted by timestamp
+            lo = 0 if start is None else int(np.searchsorted(data.timestamp, start, side="left"))
+            hi = len(data) if end is None else int(np.searchsorted(data.timestamp, end, side="left"))
+            if hi > lo:
+                slices.append(HistorySlice({name: data.columns[name][lo:hi] for name, dtype in COLUMNS}))
+        return slices
+
+    # Delete the segments of days older than keep_days
+    def prune(self, keep_days, now=None):
+        if now is None:
+            now = time.time()
+        oldest = _segmentName(now - timedelta(days=keep_days).total_seconds())
+        removed = []
+        with self.lock:
+            for segment in self.segments():
+                if segment < oldest:
+                    shutil.rmtree(os.path.join(self.directory, segment))
+                    self.repaired.discard(segment)
+                    removed.append(segment)
+        return removed
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Defaults, overridden by the [http] section of config.toml
+DEFAULTS = {
+    "CONNECT_TIMEOUT": 5.0,             # Seconds to establish a connection
+    "READ_TIMEOUT": 30.0,               # Seconds to wait for a response
+    "MAX_CONNECTIONS_PER_HOST": 8,      # Keep-alive connections pooled per host
+    "CONNECT_RETRIES": 3,               # Retries when a connection can't be made
+    "READ_RETRIES": 0,                  # Retries after a request was sent
+    "STATUS_RETRIES": 3,                # Retries on RETRY_STATUS responses. Neither these nor
+                                        # READ_RETRIES apply to NiceHash, which retries its own calls
+    "RETRY_STATUS": [429, 502, 503, 504],
+    "BACKOFF_FACTOR": 0.5,              # Sleep BACKOFF_FACTOR * 2^n seconds between retries
+}
+
+settings = dict(DEFAULTS)
+__session = None
+__plain_session = None
+__lock = threading.Lock()
+
+
+# Apply user settings. Any existing session is replaced on next use.
+def configure(user_settings=None):
+    global __session, __plain_session
+    with __lock:
+        settings.clear()
+        settings.update(DEFAULTS)
+        if user_settings:
+            settings.update(user_settings)
+        if __session is not None:
+            __session.close()
+            __session = None
+        if __plain_session is not None:
+            __plain_session.close()
+            __plain_session = None
+
+
+# With retry_responses unset, only connections that could not be made are retried,
+# so a request the server may have acted on is never sent twice from here
+def __buildSession(retry_responses=True):
+    retry = Retry(
+            total=None,
+            connect=settings["CONNECT_RETRIES"],
+            read=settings["READ_RETRIES"] if retry_responses else 0,
+            status=settings["STATUS_RETRIES"] if retry_responses else 0,
+            status_forcelist=settings["RETRY_STATUS"] if retry_responses else None,
+            backoff_factor=settings["BACKOFF_FACTOR"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+    adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=settings["MAX_CONNECTIONS_PER_HOST"],
+            pool_block=True,
+            max_retries=retry,
+        )
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+# The shared session. Connections are kept alive and reused across calls and threads.
+# With retry_responses unset, the session that leaves retrying responses to the caller.
+def session(retry_responses=True):
+    global __session, __plain_session
+    with __lock:
+        if not retry_responses:
+            if __plain_session is None:
+                __plain_session = __buildSession(retry_responses=False)
+            return __plain_session
+        if __session is None:
+            __session = __buildSession()
+        return __session
+
+
+def request(method, url, retry_responses=True, **kwargs):
+    if "timeout" not in kwargs:
+        kwargs["timeout"] = (settings["CONNECT_TIMEOUT"], settings["READ_TIMEOUT"])
+    return session(retry_responses).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
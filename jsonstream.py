@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Incremental parsing of orders.get responses.
+# The response is read in chunks, and each order of the "orders" array is
+# decoded on its own and reduced to the columns pricing.OrderBook needs, so
+# neither the whole body nor a list of every order is ever held in memory.
+
+
+import json
+import codecs
+from array import array
+from operator import itemgetter
+import numpy as np
+from pricing import OrderBook
+
+
+CHUNK_SIZE = 65536
+WHITESPACE = " \t\n\r"
+DELIMITERS = ",:]}" + WHITESPACE
+
+DECODER = json.JSONDecoder()
+ORDER_FIELDS_LIST = ["price", "limit_speed", "accepted_speed", "workers", "type"]
+
+
+# A text buffer filled from an iterator of byte chunks
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    # Read another chunk. Returns False at the end of the input.
+    def fill(self):
+        if self.eof:
+            return False
+        if self.pos > CHUNK_SIZE:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += self.utf8.decode(chunk)
+                return True
+        self.buffer += self.utf8.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    # The next character that isn't whitespace, without consuming it
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON response")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected {!r} at {!r}".format(char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    # Decode one complete JSON value
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            # A number or literal cut off by the end of the buffer may continue in the next chunk
+            if (self.buffer[end - 1] not in "}]\""
+                    and (end == len(self.buffer) or self.buffer[end] not in DELIMITERS)
+                    and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+    # Call item() for each key of an object, positioned at its value
+    def members(self, item):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            item(key)
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+# Read the "orders" array into an OrderBook.
+# The complete orders in the buffer are decoded together, up to the last "}" before
+# the end of the array. If that "}" doesn't end an order (a nested object, or a
+# string), the next order is decoded on its own instead.
+def _readOrders(stream):
+    columns = [array("d"), array("d"), array("d"), array("q"), array("b")]
+    parse = [float, float, float, int, int]
+
+    def add(orders):
+        for column, convert, field in zip(columns, parse, ORDER_FIELDS_LIST):
+            column.extend(map(convert, map(itemgetter(field), orders)))
+
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.pos += 1
+    else:
+        while True:
+            start = stream.pos
+            close = stream.buffer.find("]", start)
+            cut = stream.buffer.rfind("}", start, len(stream.buffer) if close < 0 else close)
+            orders = None
+            if cut > start:
+                try:
+                    orders = DECODER.decode("[" + stream.buffer[start:cut + 1] + "]")
+                    stream.pos = cut + 1
+                except ValueError:
+                    orders = None
+            if orders is None:
+                orders = [stream.value()]
+            add(orders)
+            if stream.peek() == ",":
+                stream.pos += 1
+                continue
+            stream.expect("]")
+            break
+
+    dtypes = [np.float64, np.float64, np.float64, np.int64, np.int8]
+    return OrderBook(*[np.frombuffer(column, dtype=dtype) if column else np.empty(0, dtype=dtype)
+                       for column, dtype in zip(columns, dtypes)])
+
+
+# Parse an orders.get response from an iterator of byte chunks.
+# Returns the response like json.loads would, except result["orders"] is an OrderBook.
+def parseOrderBookResponse(chunks):
+    stream = _Stream(chunks)
+    response = {}
+
+    def resultItem(result):
+        def item(key):
+            if key == "orders" and stream.peek() == "[":
+                result[key] = _readOrders(stream)
+            else:
+                result[key] = stream.value()
+        return item
+
+    def responseItem(key):
+        if key == "result" and stream.peek() == "{":
+            response[key] = {}
+            stream.members(resultItem(response[key]))
+        else:
+            response[key] = stream.value()
+
+    stream.members(responseItem)
+    return response
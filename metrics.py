@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Minimal metrics registry with Prometheus text format exposition.
+# Metrics are created once at module level and updated from any thread:
+#
+#   API_LATENCY = metrics.histogram("nicehash_api_request_seconds", "...", ["method"])
+#   with API_LATENCY.labels(method="orders.get").time():
+#       ...
+
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _formatLabels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append('{}="{}"'.format(name, value))
+    return "{" + ",".join(escaped) + "}"
+
+
+# Measures elapsed time into a histogram (or gauge) when the block exits
+class _Timer:
+    def __init__(self, observe):
+        self.observe = observe
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.observe(self.elapsed)
+        return False
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        return [(name, None, self.value)]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.value = float(value)
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def time(self):
+        return _Timer(self.set)
+
+    def samples(self, name):
+        return [(name, None, self.value)]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self.observe)
+
+    def samples(self, name):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], counts):
+            cumulative += count
+            samples.append((name + "_bucket", ("le", _formatValue(bound)), cumulative))
+        samples.append((name + "_count", None, cumulative))
+        samples.append((name + "_sum", None, total))
+        return samples
+
+
+# A named metric family, with one child per combination of label values
+class Metric:
+    def __init__(self, kind, name, documentation, labelnames=(), child=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.child = child
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = self.child()
+            return child
+
+    # Drop the series for these label values
+    def remove(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.children.pop(key, None)
+
+    # Metrics without labels are used directly
+    def __getattr__(self, attr):
+        if attr in ["inc", "dec", "set", "observe", "time"] and not self.labelnames:
+            return getattr(self.labels(), attr)
+        raise AttributeError(attr)
+
+    def expose(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            for name, extra, value in child.samples(self.name):
+                lines.append("{}{} {}".format(name, _formatLabels(self.labelnames, key, extra), _formatValue(value)))
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def expose(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Counter names end in _total, which is also the name of their samples
+def counter(name, documentation, labelnames=()):
+    if not name.endswith("_total"):
+        raise ValueError("Counter name {} doesn't end in _total".format(name))
+    return REGISTRY.register(Metric("counter", name, documentation, labelnames, _CounterChild))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Metric("gauge", name, documentation, labelnames, _GaugeChild))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    buckets = tuple(sorted(buckets))
+    return REGISTRY.register(Metric("histogram", name, documentation, labelnames, lambda: _HistogramChild(buckets)))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serve /metrics from a background thread. Returns the server.
+def startServer(port, address="127.0.0.1"):
+    server = ThreadingHTTPServer((address, port), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
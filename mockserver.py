@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Local stand-in for the NiceHash legacy API and the MWGrinPool API.
+# Serves synthetic order books of any size, with optional injected latency,
+# and counts the calls made to each endpoint.
+#
+#   NiceHash:    GET  /api?method=buy.info|orders.get[&my]|orders.set.price|orders.set.price.decrease|orders.refill
+#   MWGrinPool:  GET  /pool/users
+#                GET  /worker/utxo/<user_id>  (ETag / If-None-Match)
+#                POST /pool/payment/get_tx_slate/<user_id>
+#                POST /pool/payment/submit_tx_slate/<user_id>
+#   Exchange:    POST /exchange/deposit|sell|withdraw
+#                GET  /exchange/deposit|sell|withdraw/<id>
+#   Control:     GET  /_stats, POST /_reset
+
+import sys
+import json
+import base64
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LOCATIONS = [0, 1]
+ALGOS = [38, 39]
+# Algorithms listed by buy.info. Only those in ALGOS have order books and our orders.
+ALGORITHMS = {0: "Scrypt", 14: "Lyra2REv2", 20: "DaggerHashimoto", 38: "GrinCuckaroo29", 39: "GrinCuckaroo31"}
+DECREASE_STEP = 0.0001
+EXCHANGE_RATE = 0.0001      # BTC per GRIN
+WITHDRAW_FEE = 0.00001      # BTC
+
+
+# Build a synthetic orders.get book of n orders
+def syntheticBook(n, seed=0, base_price=0.4):
+    rng = random.Random(seed)
+    orders = []
+    for i in range(n):
+        workers = rng.choice([0, 0, 1, 3, 5, 10, 25])
+        orders.append({
+            "id": 1000000 + i,
+            "type": 0 if rng.random() < 0.9 else 1,
+            "price": "{:.4f}".format(base_price + rng.random() * 0.2),
+            "limit_speed": "{:.8f}".format(rng.choice([0.0, 0.01, 0.1, 1.0])),
+            "accepted_speed": "{:.8f}".format(rng.random() * 0.05 if workers else 0.0),
+            "workers": workers,
+            "alive": True,
+            "algo": 0,
+        })
+    return orders
+
+
+class MockState:
+    def __init__(self, book_size=100, my_orders=1, latency=0.0, balance=0.5):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.balance = balance              # GRIN available for payout, for each user
+        self.users = {}                     # username -> user_id
+        self.balances = {}                  # user_id -> GRIN available, once it changes
+        self.calls = Counter()
+        self.payments = 0
+        self.books = {}                     # (location, algo) -> encoded orders.get response
+        self.my_orders = {}                 # (location, algo) -> [order]
+        self.confirmations = 1              # Status checks an exchange operation stays pending for
+        self.operations = {}                # exchange operation id -> [kind, amount, checks left]
+        self.setBookSize(book_size, my_orders)
+
+    def setBookSize(self, book_size, my_orders=1):
+        with self.lock:
+            self.books = {}
+            self.my_orders = {}
+            next_id = 1
+            for location in LOCATIONS:
+                for algo in ALGOS:
+                    book = syntheticBook(book_size, seed=location * 100 + algo)
+                    self.books[(location, algo)] = json.dumps(
+                            {"result": {"orders": book, "timestamp": time.time()}, "method": "orders.get"}).encode()
+                    mine = []
+                    for i in range(my_orders):
+                        mine.append({
+                            "id": next_id,
+                            "type": 0,
+                            "price": "0.6000",
+                            "limit_speed": "0.01000000",
+                            "accepted_speed": "0.00500000",
+                            "workers": 5,
+                            "alive": True,
+                            "algo": algo,
+                        })
+                        next_id += 1
+                    self.my_orders[(location, algo)] = mine
+
+    # Every user starts over with this balance
+    def setBalance(self, balance):
+        with self.lock:
+            self.balance = balance
+            self.balances.clear()
+
+    def userId(self, username):
+        with self.lock:
+            return self.users.setdefault(username, len(self.users) + 1)
+
+    def getBalance(self, user_id):
+        with self.lock:
+            return self.balances.get(user_id, self.balance)
+
+    # Start an exchange operation. Returns its id.
+    def startOperation(self, kind, amount):
+        with self.lock:
+            operation_id = len(self.operations) + 1
+            self.operations[operation_id] = [kind, amount, self.confirmations]
+            return operation_id
+
+    # (status, amount) of an exchange operation. Each check brings it closer to done.
+    def checkOperation(self, kind, operation_id):
+        with self.lock:
+            operation = self.operations.get(operation_id)
+            if operation is None or operation[0] != kind:
+                return None
+            if operation[2] > 0:
+                operation[2] -= 1
+                return "pending", 0.0
+            return "done", operation[1]
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "total": sum(self.calls.values()), "payments": self.payments}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.payments = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, body, status=200, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def username(self):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Basic "):
+            return base64.b64decode(auth[6:]).decode().split(":", 1)[0]
+        return "mock"
+
+    def userIdFromPath(self, path):
+        try:
+            return int(path.rsplit("/", 1)[1])
+        except ValueError:
+            return 0
+
+    def count(self, name):
+        state = self.server.state
+        with state.lock:
+            state.calls[name] += 1
+        if state.latency:
+            time.sleep(state.latency)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api":
+            return self.nicehash(parse_qs(url.query, keep_blank_values=True))
+        if url.path == "/pool/users":
+            self.count("pool/users")
+            username = self.username()
+            return self.send({"id": self.server.state.userId(username), "username": username})
+        if url.path.startswith("/worker/utxo/"):
+            self.count("worker/utxo")
+            amount = int(self.server.state.getBalance(self.userIdFromPath(url.path)) * 1000000000)
+            etag = '"{}"'.format(amount)
+            if self.headers.get("If-None-Match") == etag:
+                return self.send(b"", status=304, headers={"ETag": etag})
+            return self.send({"amount": amount}, headers={"ETag": etag})
+        if url.path.startswith("/exchange/"):
+            kind = url.path.split("/")[2]
+            self.count("exchange/{}/status".format(kind))
+            status = self.server.state.checkOperation(kind, self.userIdFromPath(url.path))
+            if status is None:
+                return self.send({"error": "not found"}, status=404)
+            key = {"deposit": "amount", "sell": "btc", "withdraw": "amount"}[kind]
+            return self.send({"status": status[0], key: status[1]})
+        if url.path == "/_stats":
+            return self.send(self.server.state.stats())
+        self.send({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        state = self.server.state
+        if url.path.startswith("/pool/payment/get_tx_slate/"):
+            self.count("get_tx_slate")
+            self.body()
+            with state.lock:
+                state.payments += 1
+                slate_id = state.payments
+            balance = state.getBalance(self.userIdFromPath(url.path))
+            return self.send({"id": "mock-slate-{}".format(slate_id), "amount": int(balance * 1000000000),
+                              "participant_data": [{"id": 0}]})
+        if url.path.startswith("/pool/payment/submit_tx_slate/"):
+            self.count("submit_tx_slate")
+            slate = json.loads(self.body() or b"null")
+            if not slate or len(slate.get("participant_data", [])) < 2:
+                return self.send("Slate is not signed", status=400, content_type="text/plain")
+            with state.lock:
+                state.balances[self.userIdFromPath(url.path)] = 0.0
+            return self.send(b"", content_type="text/plain")
+        if url.path in ["/exchange/deposit", "/exchange/sell", "/exchange/withdraw"]:
+            kind = url.path.split("/")[2]
+            self.count("exchange/{}".format(kind))
+            request = json.loads(self.body() or b"{}")
+            amount = float(request.get("amount", 0))
+            if amount <= 0:
+                return self.send({"error": "Amount must be positive"}, status=400)
+            if kind == "sell":
+                amount = round(amount * EXCHANGE_RATE, 8)
+            elif kind == "withdraw":
+                amount = round(amount - WITHDRAW_FEE, 8)
+            return self.send({"id": state.startOperation(kind, amount)})
+        if url.path == "/_reset":
+            state.reset()
+            return self.send({"ok": True})
+        self.send({"error": "not found"}, status=404)
+
+    def nicehash(self, query):
+        method = query.get("method", [""])[0]
+        if method == "orders.get" and "my" in query:
+            method = "orders.get&my"
+        self.count(method)
+        state = self.server.state
+        if method == "buy.info":
+            algorithms = [{"name": name, "algo": algo, "speed_text": "GPS", "down_step": "-{:.4f}".format(DECREASE_STEP)}
+                    for algo, name in sorted(ALGORITHMS.items())]
+            return self.send({"result": {"algorithms": algorithms, "down_time": 60}, "method": method})
+        try:
+            market = (int(query["location"][0]), int(query["algo"][0]))
+        except (KeyError, ValueError):
+            return self.send({"result": {"error": "Incorrect location or algo"}, "method": method})
+        if method == "orders.get":
+            if market not in state.books:
+                return self.send({"result": {"error": "Incorrect algo"}, "method": method})
+            return self.send(state.books[market])
+        if method == "orders.get&my":
+            with state.lock:
+                mine = list(state.my_orders.get(market, []))
+            return self.send({"result": {"orders": mine}, "method": method})
+        if method == "orders.refill":
+            order_id = int(query.get("order", ["0"])[0])
+            with state.lock:
+                for order in state.my_orders.get(market, []):
+                    if order["id"] == order_id:
+                        order["btc_avail"] = "{:.8f}".format(
+                                float(order.get("btc_avail", 0)) + float(query.get("amount", ["0"])[0]))
+                        return self.send({"result": {"success": "Order refilled"}, "method": method})
+            return self.send({"result": {"error": "Order not found"}, "method": method})
+        if method in ["orders.set.price", "orders.set.price.decrease"]:
+            order_id = int(query.get("order", ["0"])[0])
+            with state.lock:
+                for order in state.my_orders.get(market, []):
+                    if order["id"] == order_id:
+                        if method == "orders.set.price":
+                            order["price"] = "{:.4f}".format(float(query["price"][0]))
+                        else:
+                            order["price"] = "{:.4f}".format(float(order["price"]) - DECREASE_STEP)
+                        return self.send({"result": {"success": "Order price changed"}, "method": method})
+            return self.send({"result": {"error": "Order not found"}, "method": method})
+        self.send({"result": {"error": "Unknown method"}, "method": method})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), state=None):
+        super().__init__(address, Handler)
+        self.state = state if state is not None else MockState()
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    # Serve from a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="mockserver", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local NiceHash and MWGrinPool stand-in")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--orders", type=int, default=100, help="orders per market order book")
+    parser.add_argument("--my-orders", type=int, default=1, help="our orders per market")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--balance", type=float, default=0.5, help="pool balance in GRIN")
+    args = parser.parse_args()
+
+    state = MockState(args.orders, args.my_orders, args.latency, args.balance)
+    server = MockServer(("127.0.0.1", args.port), state)
+    print("Serving mock NiceHash API at {}/api and MWGrinPool API at {}".format(server.url, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -17,12 +17,49 @@
 import os
 import sys
 import json
-import getpass
-import requests
+import time
+import httpclient
 import datetime
-import argparse
-import subprocess
 import toml
+import metrics
+import profiling
+import contextlib
+import grinwallet
+import slatejournal
+import poolstate
+
+
+PAYOUT_STAGE = metrics.histogram("pool_payout_stage_seconds", "Duration of each pool payout stage", ["stage"])
+PAYOUT_ERRORS = metrics.counter("pool_payout_errors_total", "Pool payouts that stopped with an error")
+
+# Payout result statuses
+PAID = "paid"                   # A new payment was made
+RESUMED = "resumed"             # An interrupted payment was finished
+INSUFFICIENT = "insufficient"   # Balance below the pool minimum, nothing to do
+FAILED = "failed"
+
+
+class PayoutError(Exception):
+    pass
+
+
+# Time one payout stage, for the metrics and the profiler
+@contextlib.contextmanager
+def _stage(name):
+    with PAYOUT_STAGE.labels(stage=name).time(), profiling.span("payout." + name):
+        yield
+
+
+# The outcome of one run_local_wallet call
+class PayoutResult:
+    def __init__(self, username, status, message=None, amount=0.0):
+        self.username = username
+        self.status = status
+        self.message = message
+        self.amount = amount
+
+    def __repr__(self):
+        return "PayoutResult({}, {}, {}, {})".format(self.username, self.status, self.message, self.amount)
 
 
 class Pool_Payout:
@@ -30,99 +67,84 @@ class Pool_Payout:
         self.poolname = "MWGrinPool"
         self.mwURL = "https://api.mwgrinpool.com"
         self.POOL_MINIMUM_PAYOUT = 0.1
-        self.tmpfile = "payment_slate.json"
+        self.tmpfile = "payment_slate.json"     # Left in the cwd by older versions
         self.dont_clean = False
+        self.journal_dir = "slate_journal"
+        self.journal = None
+        self.MAX_RESUME_ATTEMPTS = 3
+        self.state_file = "pool_state.json"     # Cached user_id and balance history
+        self.state = None
+        self.MAX_POLL_WAIT = 6 * 60 * 60        # Longest time to skip balance checks, in seconds
         self.prompted = False
         self.username = None
         self.password = None
         self.wallet_pass = None
         self.user_id = None
         self.wallet_cmd = None
+        self.wallet = None
+        self.wallet_backend = "rpc"     # "rpc" or "cli"
+        self.wallet_options = {}        # Passed to grinwallet.RpcWallet
         self.balance = 0.0
         self.unsigned_slate = None
         self.signed_slate = None
+        self.output = sys.stdout
 
     # Print progress message
     def print_progress(self, message):
-        sys.stdout.write("   ... {}:  ".format(message))
-        sys.stdout.flush()
+        self.output.write("   ... {}:  ".format(message))
+        self.output.flush()
 
     # Print success message
     def print_success(self, message=None):
         if message is None:
-            sys.stdout.write("Ok\n")
+            self.output.write("Ok\n")
         else:
             message = str(message)
-            sys.stdout.write(message)
+            self.output.write(message)
             if not message.endswith("\n"):
-                sys.stdout.write("\n")
-        sys.stdout.flush()
+                self.output.write("\n")
+        self.output.flush()
       
-    # Print an error message, footer, and exit
+    # Print an error message, footer, and stop the payout
     def error_exit(self, message):
-        print(" ")
-        print(" ")
-        print("   *** Error: {}".format(message))
-        sys.exit(1)
+        PAYOUT_ERRORS.inc()
+        print(" ", file=self.output)
+        print(" ", file=self.output)
+        print("   *** Error: {}".format(message), file=self.output)
+        raise PayoutError(message)
         
-    # Delete any existing slate and slate response
+    # Delete any slate and slate response left in the cwd by older versions
     def clean_slate_files(self):
-        if self.dont_clean == False:
+        if self.dont_clean:
             return
         unsigned_slate_filename = self.tmpfile
         signed_slate_filename = self.tmpfile+".response"
         for slatefile in [unsigned_slate_filename, signed_slate_filename]:
             if os.path.exists(slatefile):
-                os.remove(filename)
+                os.remove(slatefile)
 
     # Find the wallets executable, from the path, cwd, and build directories
     def find_wallet(self):
-        ##
-        # Find Grin Wallet Command
-        grin_wallet_cmd = None
-        cwd = os.getcwd()
-        path = os.environ.get('PATH')
-        path_add = [
-            path,
-            cwd,
-            cwd + "/grin",
-            cwd + "/grin/target/debug",
-            cwd + "/grin/target/release",
-            cwd + "/grin-wallet",
-            cwd + "/grin-wallet/target/debug",
-            cwd + "/grin-wallet/target/release",
-        ]
-        path = ":".join(path_add)
-        for directory in path.split(":"):
-            if os.path.isfile(directory + "/grin-wallet"):
-                grin_wallet_cmd = [directory + "/grin-wallet"]
-            elif os.path.isfile(directory + "/grin-wallet.exe"):
-                grin_wallet_cmd = [directory + "/grin-wallet.exe"]
-        if grin_wallet_cmd is None:
-            for directory in path.split(":"):
-                if os.path.isfile(directory + "/grin"):
-                    grin_wallet_cmd = [directory + "/grin", "wallet"]
-                elif os.path.isfile(directory + "/grin.exe"):
-                    grin_wallet_cmd = [directory + "/grin.exe", "wallet"]
-        if grin_wallet_cmd is None:
-            return("Could not find wallet executable, please add it to your PATH or copy it into this directory.")
-    
+        try:
+            self.wallet = grinwallet.getWallet(self.wallet_pass, self.wallet_backend, **self.wallet_options)
+        except grinwallet.WalletError as e:
+            return str(e)
+
         # Wallet Sanity Check
-        wallettest_cmd = grin_wallet_cmd + [ "-p", self.wallet_pass, "info" ]
-        message = None
         try:
-            message = subprocess.check_output(wallettest_cmd, stderr=subprocess.STDOUT, shell=False)
-            self.wallet_cmd = grin_wallet_cmd
+            message = self.wallet.info()
+            self.wallet_cmd = self.wallet.cli.cmd
             return(message)
-        except subprocess.CalledProcessError as exc:
-            return "Wallet test failed with output: {}".format(exc.output.decode("utf-8"))
-        except Exception as e:
-            return "Wallet test failed with error {}".format(str(e))
+        except grinwallet.WalletError as e:
+            return "Wallet test failed: {}".format(str(e))
 
-    # Get my pool user_id
+    # Get my pool user_id, from the cache if we have it
     def get_user_id(self):
+        self.user_id = self.state.getUserId(self.state_key())
+        if self.user_id is not None:
+            return None
         get_user_id_url = self.mwURL + "/pool/users"
-        r = requests.get(
+        r = httpclient.get(
                 url = get_user_id_url,
                 auth = (self.username, self.password),
         )
@@ -131,30 +153,48 @@ class Pool_Payout:
             message = "Failed to get your account information from {}: {}".format(self.poolname, r.text)
             return message
         self.user_id = str(r.json()["id"])
+        self.state.setUserId(self.state_key(), self.user_id)
         return None
 
-    # Get the users balance
+    # Get the users balance. Sends the last ETag, so an unchanged balance is a 304 with no body.
     def get_balance(self):
         get_user_balance = self.mwURL + "/worker/utxo/" + self.user_id
-        r = requests.get(
+        last_balance, etag = self.state.lastBalance(self.state_key())
+        headers = {}
+        if etag is not None and last_balance is not None:
+            headers["If-None-Match"] = etag
+        r = httpclient.get(
                 url = get_user_balance,
                 auth = (self.username, self.password),
+                headers = headers,
         )
+        if r.status_code == 304:
+            self.balance = last_balance
+            self.state.recordBalance(self.state_key(), self.balance, etag=etag)
+            return None
         if r.status_code != 200:
+            # The cached user_id may be stale
+            self.state.setUserId(self.state_key(), None)
+            self.balance = None
             return "Failed to get your account balance: {}".format(r.text)
-        if r.json() is None:
+        utxo = r.json()
+        if utxo is None:
             balance_nanogrin = 0
         else:
-            balance_nanogrin = r.json()["amount"]
+            balance_nanogrin = utxo["amount"]
         self.balance = balance_nanogrin / 1000000000.0
         if self.balance < 0:
             self.balance = 0.0
+        self.state.recordBalance(self.state_key(), self.balance, etag=r.headers.get("ETag"))
+
+    def state_key(self):
+        return poolstate.PoolState.key(self.mwURL, self.username)
 
     def get_unsigned_slate(self):
         ##
         # Get the initial tx slate and write it to a file
         get_tx_slate_url = self.mwURL + "/pool/payment/get_tx_slate/" + self.user_id
-        r = requests.post(
+        r = httpclient.post(
                 url = get_tx_slate_url,
                 auth = (self.username, self.password),
         )
@@ -162,39 +202,18 @@ class Pool_Payout:
             return "Failed to get a payment slate: {}".format(r.text)
         self.unsigned_slate = r.text
 
-    # Write json slate to a file
-    def write_unsigned_slate_file(self):
-        try:
-            f = open(self.tmpfile, "w")
-            f.write(self.unsigned_slate) 
-            f.flush()
-            f.close()
-            return None
-        except Exception as e:
-            return "Error saving payment slate to file: {}".format(str(e))
-        
-    def sign_slate_with_wallet_cli(self):
-        ##
-        # Call the wallet CLI to receive and sign the slate
-        recv_cmd = self.wallet_cmd + [
-                "-p", self.wallet_pass,
-              "receive",
-                "-i", self.tmpfile,
-        ]
+    # Receive and sign the slate, over the wallet RPC API or its command line
+    def sign_slate_with_wallet(self):
         try:
-            output = subprocess.check_output(recv_cmd, stderr=subprocess.STDOUT, shell=False)
-            with open(self.tmpfile + '.response', 'r') as tx_slate_response:
-                self.signed_slate = tx_slate_response.read()
-        except subprocess.CalledProcessError as exc:
-            return "Signing slate failed with output: {}".format(exc.output.decode("utf-8"))
-        except Exception as e:
-            return "Wallet receive failed with error: {}".format(str(e))
-        
+            self.signed_slate = self.wallet.receive(self.unsigned_slate)
+        except grinwallet.WalletError as e:
+            return str(e)
+
     def return_payment_slate(self):
         ##
         # Submit the signed slate back to the pool to be finalized and posted to the network
         submit_tx_slate_url = self.mwURL + "/pool/payment/submit_tx_slate/" + self.user_id
-        r = requests.post(
+        r = httpclient.post(
                 url = submit_tx_slate_url,
                 data = self.signed_slate,
                 auth = (self.username, self.password),
@@ -205,67 +224,130 @@ class Pool_Payout:
 
 
         
+    # Finish a payout that was interrupted by a crash, from its journal entry.
+    # A slate we couldn't sign is abandoned; the pool cancels unsigned payments on its own.
+    # A signed slate is resubmitted, and given up on after MAX_RESUME_ATTEMPTS failures
+    # since the pool may already have finalized it before the crash.
+    def resume_payment(self, entry):
+        self.unsigned_slate = entry["unsigned_slate"]
+        self.signed_slate = entry["signed_slate"]
+        if entry["state"] == slatejournal.REQUESTED:
+            message = None
+            if self.wallet_cmd is None:
+                message = self.find_wallet()
+            if self.wallet_cmd is not None:
+                message = self.sign_slate_with_wallet()
+            if message is not None:
+                self.journal.clear(self.user_id)
+                return "Could not sign the interrupted payment, it was abandoned: {}".format(message)
+            self.journal.record(self.user_id, slatejournal.SIGNED, self.unsigned_slate, self.signed_slate,
+                    amount=entry.get("amount", 0.0))
+        message = self.return_payment_slate()
+        if message is None:
+            self.journal.clear(self.user_id)
+            return None
+        attempts = entry.get("attempts", 0) + 1
+        if attempts >= self.MAX_RESUME_ATTEMPTS:
+            self.journal.clear(self.user_id)
+            return "{} (giving up after {} attempts)".format(message, attempts)
+        self.journal.record(self.user_id, slatejournal.SIGNED, self.unsigned_slate, self.signed_slate, attempts,
+                entry.get("amount", 0.0))
+        return message
+
+    # Do a payout. Returns a PayoutResult; errors are returned as FAILED results.
     def run_local_wallet(self):
-        ##
-        # Do payout 
+        try:
+            return self.__run_local_wallet()
+        except PayoutError as e:
+            return PayoutResult(self.username, FAILED, str(e))
 
-        # Check for unsubmitted signed slate
-        # xxx
+    def __run_local_wallet(self):
+        ##
+        # Do payout. The cheap pool checks run first, so the wallet is only
+        # touched when there is a payment to make.
 
         # Cleanup
         self.clean_slate_files()
-    
-        # Find wallet Command
-        self.print_progress("Locating your grin wallet command");
-        message = self.find_wallet()
-        if self.wallet_cmd is None:
-            self.error_exit(message)
-        self.print_success()
+        self.state = poolstate.get(self.state_file)
 
-	    # Find User ID
+        # Find User ID
         self.print_progress("Getting your pool User ID");
-        message = self.get_user_id()
+        with _stage("get_user_id"):
+            message = self.get_user_id()
         if self.user_id is None:
             self.error_exit(message)
         self.print_success()
+
+        # Check for a payout interrupted by a crash
+        self.journal = slatejournal.SlateJournal(self.journal_dir)
+        entry = self.journal.load(self.user_id)
+        if entry is not None:
+            self.print_progress("Resuming the interrupted payment")
+            with _stage("resume_payment"):
+                message = self.resume_payment(entry)
+            if message is not None:
+                self.error_exit(message)
+            self.print_success()
+            return PayoutResult(self.username, RESUMED, amount=entry.get("amount", 0.0))
+
+        # Skip the balance check until the balance is predicted to reach the minimum
+        next_poll = self.state.nextPoll(self.state_key(), self.POOL_MINIMUM_PAYOUT, self.MAX_POLL_WAIT)
+        if next_poll > time.time():
+            message = "Balance not expected to reach the minimum payout yet, next check after {}".format(
+                    datetime.datetime.fromtimestamp(next_poll).strftime("%Y-%m-%d %H:%M:%S"))
+            print("   {}".format(message), file=self.output)
+            return PayoutResult(self.username, INSUFFICIENT, message)
     
         # Find balance
         self.print_progress("Getting your Avaiable Balance");
-        message = self.get_balance()
+        with _stage("get_balance"):
+            message = self.get_balance()
         if self.balance == None:
             self.error_exit(message)
         self.print_success(self.balance)
         # Only continue if there are funds available
         if self.balance < self.POOL_MINIMUM_PAYOUT:
-            self.error_exit("Insufficient Available Balance for payout: Minimum: {}, Available: {}".format(self.POOL_MINIMUM_PAYOUT, self.balance))
+            message = "Insufficient Available Balance for payout: Minimum: {}, Available: {}".format(self.POOL_MINIMUM_PAYOUT, self.balance)
+            print("   {}".format(message), file=self.output)
+            return PayoutResult(self.username, INSUFFICIENT, message, self.balance)
+
+        # Find wallet Command
+        self.print_progress("Locating your grin wallet command");
+        with _stage("find_wallet"):
+            message = self.find_wallet()
+        if self.wallet_cmd is None:
+            self.error_exit(message)
+        self.print_success()
 
         # Get payment slate from Pool
         self.print_progress("Requesting a Payment from the pool");
-        message = self.get_unsigned_slate()
+        with _stage("get_unsigned_slate"):
+            message = self.get_unsigned_slate()
         if self.unsigned_slate is None:
             self.error_exit(message)
-        # Write the slate to file
-        message = self.write_unsigned_slate_file()
-        if not os.path.isfile(self.tmpfile):
-            self.error_exit(message)
+        self.journal.record(self.user_id, slatejournal.REQUESTED, self.unsigned_slate, amount=self.balance)
         self.print_success()
 
         # Call grin wallet to receive the slate and sign it
         self.print_progress("Processing the payment with your wallet")
-        message = self.sign_slate_with_wallet_cli()
+        with _stage("sign_slate"):
+            message = self.sign_slate_with_wallet()
         if message is not None:
+            self.journal.clear(self.user_id)
             self.error_exit(message)
+        self.journal.record(self.user_id, slatejournal.SIGNED, self.unsigned_slate, self.signed_slate,
+                amount=self.balance)
         self.print_success()
 
         # Return the signed slate to the pool
         self.print_progress("Returning the signed payment slate to the pool");
-        message = self.return_payment_slate()
+        with _stage("return_payment_slate"):
+            message = self.return_payment_slate()
         if message is not None:
             self.error_exit(message)
+        self.journal.clear(self.user_id)
         self.print_success()
-
-        # Cleanup
-        self.clean_slate_files()
+        return PayoutResult(self.username, PAID, amount=self.balance)
 
 
 
@@ -278,5 +360,5 @@ if __name__ == "__main__":
         pass
 
     payout = Pool_Payout()
-    payout.run_local_wallet()
-    sys.exit(0)
+    result = payout.run_local_wallet()
+    sys.exit(1 if result.status == FAILED else 0)
@@ -15,213 +15,571 @@
 # limitations under the License.
 
 
-import os
-import sys
 import time
-import json
 import pprint
-import requests
+import httpclient
 import traceback
 import toml
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from ratelimit import TokenBucket
+from cache import TTLCache
+from pricing import STRATEGIES
+from statestore import OrderStateStore
+from history import MarketHistory
+from cadence import AdaptivePoller
+from registry import MarketRegistry
+import reconcile
+import resilience
+import jsonstream
+import planner
+import metrics
+import profiling
 pp = pprint.PrettyPrinter(indent=4)
 
-## Load user config
-config = toml.load("config.toml")
-API_ID = config['nicehash']['API_ID']
-API_KEY = config['nicehash']['API_KEY']
-PRICE_ADJUST_RATE = config['nicehash']['PRICE_ADJUST_RATE']
-
-if PRICE_ADJUST_RATE == "slow":
-    MAX_INCREASE = 0.0001   # Maximum amount to increase at once
-    TARGET_MIN_ADD = 0.0000 # Amount to set order price over the absolute minimum
-elif PRICE_ADJUST_RATE == "medium":
-    MAX_INCREASE = 0.0002   # Maximum amount to increase at once
-    TARGET_MIN_ADD = 0.0001 # Amount to set order price over the absolute minimum
-elif PRICE_ADJUST_RATE == "fast":
-    MAX_INCREASE = 0.0005   # Maximum amount to increase at once
-    TARGET_MIN_ADD = 0.0001 # Amount to set order price over the absolute minimum
-else:
-    print("Error:  Missing config for nicehash PRICE_ADJUST_RATE")
-    print("  Make sure PRICE_ADJUST_RATE is set to either \"slow\", \"medium\", or \"fast\" in config.toml")
-    print("{}".format(str(e)))
-    print("  ")
-    sys.exit(1)
-
-orders = {}
-
-# Location Numbers (as defined: https://www.nicehash.com/doc-api)
-# 0 for Europe (NiceHash), 1 for USA (WestHash);
-LOCATIONS = {
-        "EU": 0,
-        "US": 1,
-    }
 
-# Algorithms
-ALGOS = {
-        # ... Add More as needed
-        "GrinCuckaroo29": 38,
-        "GrinCuckaroo31": 39,
+DEFAULT_API_URL = "https://api.nicehash.com/api"
+DECREASE_STEP = 0.0001      # Amount orders.set.price.decrease lowers the price by
+
+# Methods that are safe to send again when a response is lost. orders.set.price.decrease
+# is not: it is only retried when NiceHash rejected it for the rate limit.
+IDEMPOTENT_METHODS = ["orders.get", "orders.get&my", "orders.set.price", "buy.info"]
+
+# PRICE_ADJUST_RATE -> (maximum amount to increase at once, amount to set order price over the target)
+PRICE_ADJUST_RATES = {
+        "slow": (0.0001, 0.0000),
+        "medium": (0.0002, 0.0001),
+        "fast": (0.0005, 0.0001),
     }
 
-def __getLocationName(loc_num):
-    if type(loc_num) == "String":
-        loc_num = int(loc_num)
-    for name, number in LOCATIONS.items():
-        if number == loc_num:
-            return name
-
-def __getAlgoName(alg_num):
-    if type(alg_num) == "String":
-        alg_num = int(alg_num)
-    for name, number in ALGOS.items():
-        if number == alg_num:
-            return name
-
-def __callNicehashApi(method, args):
-    url = "https://api.nicehash.com/api?method=" + method
-    for arg, val in args.items():
-        url +=  "&{}={}".format(arg, val)
-          
-    time.sleep(5)
-    r = requests.get(
-            url=url,
-        )
-    if r.status_code >= 300 or r.status_code < 200:
-        error_msg = "Error calling {}.  Code: {} Reason: {}".format(url, r.status_code, r.reason)
-        raise Exception(error_msg)
-        
-    r_json = r.json()
-    result = r_json["result"]
-    if "error" in result:
-        message = result["error"]
-        method = r_json["method"]
-        error_msg = "Error calling {}. Reason: {}".format(method, message)
-        raise Exception(error_msg)
-    return result
+API_LATENCY = metrics.histogram("nicehash_api_request_seconds", "NiceHash API request latency", ["method"])
+API_ERRORS = metrics.counter("nicehash_api_errors_total", "NiceHash API calls that failed", ["method", "kind"])
+CIRCUITS_OPEN = metrics.gauge("nicehash_circuits_open", "NiceHash API circuit breakers that are not closed")
+UPDATE_DURATION = metrics.gauge("nicehash_update_duration_seconds", "Duration of the last updateOrders call")
+ORDER_PRICE = metrics.gauge("nicehash_order_price", "Current order price", ["order", "location", "algo"])
+ORDER_TARGET = metrics.gauge("nicehash_order_target_price", "Target order price", ["order", "location", "algo"])
+ORDER_DELTA = metrics.gauge("nicehash_order_delta", "Order price minus target price", ["order", "location", "algo"])
 
 
-def updateOrders():
-    # Get all current orders
-    current_orders = {}
-    for location in LOCATIONS.values():
-        for algo in ALGOS.values():
-            getMyOrders_args = {
-                "id": API_ID,
-                "key": API_KEY,
-                "location": location,
-                "algo": algo,
-                }
-            result = __callNicehashApi("orders.get&my", getMyOrders_args)
-            for order in result["orders"]:
-                order_id = order["id"]
-                current_orders[order_id] = order
-                current_orders[order_id]["algo"] = int(algo)
-                current_orders[order_id]["location"] = int(location)
-
-    # Update the orders we are tracking
-    # Remove orders that no longer exist
-    for order_id in orders.keys():
-        if not order_id in current_orders:
-            print("Order no longer exists: {}".format(order_id))
-            del orders[order_id]
-
-    # Add new orders
-    for order_id in current_orders.keys():
-        if not order_id in orders:
-            print("New order added: {}".format(order_id))
-            orders[order_id] = current_orders[order_id]
-            orders[order_id]["last_decreased"] = datetime(1970, 1, 1)
-
-    # Update existing orders
-    for order_id in current_orders.keys():
-        if order_id in orders:
-            orders[order_id]["limit_speed"] = float(current_orders[order_id]["limit_speed"])
-            orders[order_id]["alive"] = current_orders[order_id]["alive"]
-            orders[order_id]["price"] = float(current_orders[order_id]["price"])
-            orders[order_id]["workers"] = int(current_orders[order_id]["workers"])
-            orders[order_id]["accepted_speed"] = float(current_orders[order_id]["accepted_speed"])
-
-    # Find the lowest price thats has miners working for each algo in each location
-    target_prices = {}
-    for location_name, location in LOCATIONS.items():
-        for algo_name, algo in ALGOS.items():
-            # Get all orders in this location and algo
-            getOrders_args = {
-                "id": API_ID,
-                "key": API_KEY,
-                "location": location,
-                "algo": algo,
-                }
-            try:
-                result = __callNicehashApi("orders.get", getOrders_args)
-                # Get minimum price, throw out the lowest value
-                prices = [o["price"] for o in result["orders"] if int(o["workers"]) > 2 and float(o["accepted_speed"]) > 0.00000005 and int(o["type"]) == 0]
-                prices = sorted(prices)
-                target_price = float(prices[0])
-                if location not in target_prices:
-                    target_prices[location] = {}
-                target_prices[location][algo] = round(target_price+TARGET_MIN_ADD, 4)
-            except Exception as e:
-                print("Error: {}".format(str(e)))
-                print(traceback.print_exc())
-    
-    # Update each order
-    for order_id, order in orders.items():
-        location = order["location"]
-        algo = order["algo"]
-        # Decrease or Increase Order price
-        order["target_price"] = target_prices[location][algo]
-        order["delta"] = order["price"] - order["target_price"]
-        if order["price"] > order["target_price"]:
-            # Decrease Order Price
-            decreasePrice_args = {
-                "id": API_ID,
-                "key": API_KEY,
-                "location": location,
-                "algo": algo,
-                "order": order_id,
-                }
-            try:
-                result = __callNicehashApi("orders.set.price.decrease", decreasePrice_args)
-                orders[order_id]["last_decreased"] = datetime.now()
-                orders[order_id]["change"] = "-{}".format(0.0001)
-            except Exception as e:
-                orders[order_id]["change"] = "None: error: {}".format(str(e))
-        elif order["price"] < order["target_price"]:
-            # Increase Order price
-            increase_to = min(order["price"]+MAX_INCREASE, order["target_price"])
-            increasePrice_args = {
-                "id": API_ID,
-                "key": API_KEY,
-                "location": location,
-                "algo": algo,
-                "order": order_id,
-                "price": increase_to,
-                }
+# A [nicehash] setting is missing or invalid
+class ConfigError(Exception):
+    pass
+
+
+# Keeps the orders of one NiceHash API key at their target prices.
+# Nothing is opened or started until the first updateOrders call, and each
+# client has its own orders, rate limiter, order book cache, state store and planner.
+class NicehashClient:
+    def __init__(self, api_id, api_key, price_adjust_rate="fast", api_url=DEFAULT_API_URL,
+                 rate_limit=1.0, rate_burst=4, max_workers=8, order_book_ttl=30, order_book_cache_size=64,
+                 target_strategy="minimum", target_percentile=10, target_depth=0.0, state_db="nicehash_state.db",
+                 decrease_cooldown=timedelta(minutes=10), pending_timeout=timedelta(minutes=15),
+                 increase_interval=timedelta(minutes=1), history_dir=None, history_retention_days=0, poller=None,
+                 api_retries=2, api_backoff=0.5, api_backoff_max=30.0, breaker_failures=3, breaker_reset=300.0,
+                 registry_file="nicehash_registry.json", registry_ttl=86400.0, market_sweep_interval=900.0,
+                 market_sweep_batch=4):
+        if price_adjust_rate not in PRICE_ADJUST_RATES:
+            raise ConfigError("Missing config for nicehash PRICE_ADJUST_RATE\n"
+                    "  Make sure PRICE_ADJUST_RATE is set to either \"slow\", \"medium\", or \"fast\" in config.toml")
+        if target_strategy not in STRATEGIES:
+            raise ConfigError("Unknown nicehash TARGET_STRATEGY \"{}\"\n"
+                    "  Make sure TARGET_STRATEGY is set to one of {} in config.toml".format(
+                    target_strategy, ", ".join(STRATEGIES)))
+        self.api_id = api_id
+        self.api_key = api_key
+        self.price_adjust_rate = price_adjust_rate
+        self.max_increase, self.target_min_add = PRICE_ADJUST_RATES[price_adjust_rate]
+        self.api_url = api_url
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.max_workers = max_workers
+        self.order_book_ttl = order_book_ttl
+        self.order_book_cache_size = order_book_cache_size
+        self.target_strategy = target_strategy
+        self.target_percentile = target_percentile
+        self.target_depth = target_depth
+        self.state_db = state_db
+        self.decrease_cooldown = decrease_cooldown
+        self.pending_timeout = pending_timeout
+        self.increase_interval = increase_interval
+        self.history_dir = history_dir
+        self.history_retention_days = history_retention_days
+
+        self.orders = {}            # order_id -> reconcile.Order
+        self.state_store = None
+        self.price_planner = None
+        self.history = None
+        # Decides which markets each updateOrders call polls. None polls every market every time.
+        self.poller = poller
+        self.target_prices = {}     # location -> {algo: target price}, as of each market's last poll
+        self.api_retries = api_retries
+        self.api_backoff = api_backoff
+        self.api_backoff_max = api_backoff_max
+        # One breaker per (method, location, algo), so a failing market is skipped without holding up the others
+        self.breakers = resilience.Breakers(breaker_failures, breaker_reset)
+        # Shared by every API call of this key, so concurrent requests stay within the NiceHash limits
+        self.rate_limiter = TokenBucket(rate_limit, rate_burst)
+        # Market order books, keyed by (location, algo)
+        self.order_book_cache = TTLCache(order_book_ttl, order_book_cache_size)
+        # Algorithm and location names, and the markets we hold orders in. Read on the first updateOrders call.
+        self.registry = MarketRegistry(registry_file, registry_ttl, market_sweep_interval, api_id)
+        self.market_sweep_batch = market_sweep_batch
+
+    # Build a client from the [nicehash] section of config.toml
+    @classmethod
+    def from_config(cls, config):
+        try:
+            return cls(
+                    config['API_ID'],
+                    config['API_KEY'],
+                    price_adjust_rate=config.get('PRICE_ADJUST_RATE'),
+                    api_url=config.get('API_URL', DEFAULT_API_URL),
+                    rate_limit=config.get('API_RATE_LIMIT', 1.0),
+                    rate_burst=config.get('API_RATE_BURST', 4),
+                    max_workers=config.get('API_MAX_WORKERS', 8),
+                    order_book_ttl=config.get('ORDER_BOOK_TTL', 30),
+                    order_book_cache_size=config.get('ORDER_BOOK_CACHE_SIZE', 64),
+                    target_strategy=config.get('TARGET_STRATEGY', "minimum"),
+                    target_percentile=config.get('TARGET_PERCENTILE', 10),
+                    target_depth=config.get('TARGET_DEPTH', 0.0),
+                    state_db=config.get('STATE_DB', "nicehash_state.db"),
+                    decrease_cooldown=timedelta(minutes=config.get('DECREASE_COOLDOWN_MINUTES', 10)),
+                    pending_timeout=timedelta(minutes=config.get('PENDING_TIMEOUT_MINUTES', 15)),
+                    increase_interval=timedelta(minutes=config.get('INCREASE_INTERVAL_MINUTES', 1)),
+                    history_dir=config.get('HISTORY_DIR') or None,
+                    history_retention_days=config.get('HISTORY_RETENTION_DAYS', 0),
+                    poller=AdaptivePoller(
+                            config.get('POLL_MIN_SECONDS', 60),
+                            config.get('POLL_MAX_SECONDS', 1800),
+                            config.get('POLL_BACKOFF', 1.5),
+                            config.get('API_CALLS_PER_HOUR', 600),
+                        ) if config.get('ADAPTIVE_POLLING', False) else None,
+                    api_retries=config.get('API_RETRIES', 2),
+                    api_backoff=config.get('API_BACKOFF_SECONDS', 0.5),
+                    api_backoff_max=config.get('API_BACKOFF_MAX_SECONDS', 30.0),
+                    breaker_failures=config.get('BREAKER_FAILURES', 3),
+                    breaker_reset=config.get('BREAKER_RESET_SECONDS', 300.0),
+                    registry_file=config.get('REGISTRY_FILE', "nicehash_registry.json") or None,
+                    registry_ttl=3600 * config.get('REGISTRY_TTL_HOURS', 24),
+                    market_sweep_interval=60 * config.get('MARKET_SWEEP_MINUTES', 15),
+                    market_sweep_batch=config.get('MARKET_SWEEP_BATCH', 4),
+                )
+        except KeyError as e:
+            raise ConfigError("Missing config for nicehash {}".format(str(e)))
+
+    # Send one API request. Failures raise resilience.ApiError, or the requests exception.
+    # With stream set, the response is an orders.get response, parsed as it arrives
+    # by jsonstream into a result whose "orders" is an OrderBook.
+    def __send(self, method, args, stream=False):
+        url = self.api_url + "?method=" + method
+        for arg, val in args.items():
+            url +=  "&{}={}".format(arg, val)
+
+        with profiling.span("api.throttle"):
+            self.rate_limiter.acquire()
+        try:
+            with API_LATENCY.labels(method=method).time():
+                with profiling.span("api.request"):
+                    # resilience.retry is the only retry policy for these calls:
+                    # transport retries would replay price decreases
+                    r = httpclient.get(
+                            url=url,
+                            stream=stream,
+                            retry_responses=False,
+                        )
+                try:
+                    if r.status_code >= 300 or r.status_code < 200:
+                        kind = resilience.classifyStatus(r.status_code)
+                        error_msg = "Error calling {}.  Code: {} Reason: {}".format(url, r.status_code, r.reason)
+                        raise resilience.ApiError(error_msg, kind)
+                    # A streamed body is read while it is parsed, so this includes its download
+                    with profiling.span("api.parse"):
+                        if stream:
+                            r_json = jsonstream.parseOrderBookResponse(r.iter_content(jsonstream.CHUNK_SIZE))
+                        else:
+                            r_json = r.json()
+                finally:
+                    r.close()
+        except Exception as e:
+            API_ERRORS.labels(method=method, kind=resilience.classify(e)).inc()
+            raise
+
+        result = r_json["result"]
+        if "error" in result:
+            message = result["error"]
+            kind = resilience.classifyMessage(message)
+            API_ERRORS.labels(method=method, kind=kind).inc()
+            method = r_json["method"]
+            error_msg = "Error calling {}. Reason: {}".format(method, message)
+            raise resilience.ApiError(error_msg, kind)
+        return result
+
+    # Call the API through the breaker of the method and market, retrying
+    # rate limited and transient failures with jittered exponential backoff
+    def __callApi(self, method, args, stream=False):
+        breaker = self.breakers.get((method, args.get("location"), args.get("algo")))
+        if not breaker.allow():
+            API_ERRORS.labels(method=method, kind=resilience.CIRCUIT_OPEN).inc()
+            raise resilience.CircuitOpenError("Skipped {} for location {} algo {} after repeated failures".format(
+                    method, args.get("location"), args.get("algo")))
+        if method in IDEMPOTENT_METHODS:
+            retry_kinds = [resilience.RATE_LIMIT, resilience.TRANSIENT]
+        else:
+            retry_kinds = [resilience.RATE_LIMIT]
+        try:
+            result = resilience.retry(lambda: self.__send(method, args, stream),
+                    self.api_retries, self.api_backoff, self.api_backoff_max, retry_kinds)
+        except Exception:
+            breaker.failure()
+            raise
+        breaker.success()
+        return result
+
+    # True while either polling call of a market is refused by its breaker
+    def __marketTripped(self, market):
+        location, algo = market
+        return any(self.breakers.get((method, location, algo)).isOpen() for method in ["orders.get", "orders.get&my"])
+
+    def __args(self, location, algo):
+        return {
+            "id": self.api_id,
+            "key": self.api_key,
+            "location": location,
+            "algo": algo,
+            }
+
+    # Get our own orders in one market
+    def getMyOrders(self, location, algo):
+        return self.__callApi("orders.get&my", self.__args(location, algo))
+
+    # Get all orders in one market, as an OrderBook. Snapshots are cached for order_book_ttl
+    # seconds, and concurrent requests for the same market share one API call.
+    # Each snapshot fetched is recorded in the market history, if there is one.
+    def getOrderBook(self, location, algo):
+        def fetch():
+            result = self.__callApi("orders.get", self.__args(location, algo), stream=True)
+            book = result["orders"]
+            if self.history is not None:
+                try:
+                    self.history.append(location, algo, result.get("timestamp", time.time()), book)
+                except OSError as e:
+                    print("Error: Could not record market history: {}".format(str(e)))
+            return book
+        return self.order_book_cache.get((location, algo), fetch)
+
+    # Every (location, algo) market we hold orders in: those the last sweep found,
+    # and those of the orders we track, so an order that goes away is noticed
+    def markets(self):
+        markets = set(self.registry.activeMarkets())
+        markets.update((order.location, order.algo) for order in self.orders.values())
+        return sorted(markets)
+
+    # Refresh the algorithms from buy.info once they are older than the registry TTL.
+    # On failure the ones already known are kept, and discovery is tried again next run.
+    def __discoverAlgorithms(self):
+        registry = self.registry
+        if not registry.stale():
+            return
+        try:
+            result = self.__callApi("buy.info", {})
+            algos = {algo["name"]: int(algo["algo"]) for algo in result["algorithms"]}
+        except Exception as e:
+            print("Error: Could not discover NiceHash algorithms, using the {} known: {}".format(len(registry.algos), str(e)))
+            return
+        if algos:
+            registry.setAlgorithms(algos)
+            print("Discovered {} NiceHash algorithms".format(len(algos)))
+
+    # Look for our orders in a few more markets of the sweep in progress, as far as
+    # the polling budget allows. Only the markets holding orders are polled otherwise.
+    # A market that couldn't be read keeps its last state.
+    def __sweepMarkets(self):
+        registry = self.registry
+        markets = registry.nextSweep(self.market_sweep_batch)
+        if self.poller is not None:
+            # One orders.get&my call per market
+            for count, market in enumerate(markets):
+                if not self.poller.spend(1):
+                    markets = markets[:count]
+                    break
+        if not markets:
+            return
+        results = {}
+        for market, result in self.__fetchPerMarket(self.getMyOrders, markets).items():
+            results[market] = None if isinstance(result, Exception) else bool(result["orders"])
+        if registry.sweepResults(results):
+            active = registry.activeMarkets()
+            print("Found our orders in {} markets: {}".format(len(active), ", ".join(
+                    "{} {}".format(registry.locationName(location), registry.algoName(algo)) for location, algo in active)))
+
+    # Call fetch(location, algo) once for each market, concurrently.
+    # Returns {(location, algo): result or exception}
+    def __fetchPerMarket(self, fetch, markets):
+        def call(market):
             try:
-                result = __callNicehashApi("orders.set.price", increasePrice_args)
-                orders[order_id]["change"] = increase_to - order["price"]
+                return fetch(*market)
             except Exception as e:
-                orders[order_id]["change"] = "None: error: {}".format(str(e))
-        else:
-            orders[order_id]["change"] = "None needed"
-
-
-    ## Print Report
-        
-    print("##  Completed control loop: {} - {}".format(PRICE_ADJUST_RATE, datetime.now()))
-    print("##")
-    print("#           |       |                  |  Current  |  Target  |          |  Price          ")
-    print("#     Id    |  Loc  |    Algorithm     |  Price    |  Price   |  Delta   |  Change         ")
-    print("  ----------|-------|------------------|-----------|----------|----------|-----------------------")
-    for order_id, order in orders.items():
-        print("  {} {} {} {} {} {}   {}".format(
-                str(order["id"]).center(10),
-                __getLocationName(order["location"]).center(7),
-                __getAlgoName(order["algo"]).center(18),
-                str(round(order["price"], 4)).center(11),
-                str(round(order["target_price"], 4)).center(10),
-                str(round(order["delta"], 4)).center(10),
-                order["change"],
-            ))
+                return e
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(profiling.bind(call), markets)
+            return dict(zip(markets, results))
+
+    # Add amount BTC from the NiceHash balance to one of our tracked orders
+    def refillOrder(self, order_id, amount):
+        order = self.orders.get(order_id)
+        if order is None:
+            raise resilience.ApiError("Order {} is not one of our tracked orders".format(order_id))
+        args = self.__args(order.location, order.algo)
+        args["order"] = order_id
+        args["amount"] = amount
+        self.__callApi("orders.refill", args)
+        self.watchMarket(order.location, order.algo)
+
+    # Poll a market from the next updateOrders call on, without waiting for the next
+    # sweep to find our orders in it. Call it after placing an order in a new market.
+    def watchMarket(self, location, algo):
+        self.registry.load()
+        self.registry.addActive([(int(location), int(algo))])
+
+    # Send a planned price change for one order. Returns True on success.
+    def __changeOrderPrice(self, order_id, order, action, new_price):
+        args = self.__args(order.location, order.algo)
+        args["order"] = order_id
+        try:
+            if action == planner.DECREASE:
+                # Decrease Order Price
+                self.__callApi("orders.set.price.decrease", args)
+                order.last_decreased = datetime.now()
+                order.change = "-{}".format(DECREASE_STEP)
+            else:
+                # Increase Order price
+                args["price"] = new_price
+                self.__callApi("orders.set.price", args)
+                order.last_increased = datetime.now()
+                order.change = new_price - (order.pending_price or order.price)
+            reconcile.markPending(order, new_price, datetime.now())
+            return True
+        except Exception as e:
+            order.change = "None: error: {}".format(str(e))
+            return False
+
+    # Open the state store and restore the orders tracked by the previous run.
+    # Opens the market history too, and drops days past its retention.
+    def __loadState(self):
+        if self.state_store is None:
+            self.state_store = OrderStateStore(self.state_db, self.api_id)
+            self.orders.update(self.state_store.load())
+            if self.orders:
+                print("Restored {} orders from {}".format(len(self.orders), self.state_db))
+        if self.history is None and self.history_dir is not None:
+            self.history = MarketHistory(self.history_dir)
+        self.registry.load()
+        if self.history is not None and self.history_retention_days:
+            for segment in self.history.prune(self.history_retention_days):
+                print("Removed market history of {}".format(segment))
+
+    # Start the planner that sends scheduled price changes between control loops
+    def __startPlanner(self):
+        if self.price_planner is None:
+            self.price_planner = planner.PricePlanner(self.__changeOrderPrice, DECREASE_STEP, self.decrease_cooldown,
+                    self.max_increase, self.increase_interval, self.max_workers)
+            self.price_planner.start()
+
+    # Stop the planner, then save the order state and close the state store
+    def close(self):
+        if self.price_planner is not None:
+            self.price_planner.stop()
+            self.price_planner = None
+        if self.state_store is not None:
+            # Keep what the planner sent since the last run, such as when orders were decreased
+            self.state_store.sync(self.orders)
+            self.state_store.close()
+            self.state_store = None
+
+    def updateOrders(self):
+        with UPDATE_DURATION.time(), profiling.span("updateOrders"):
+            self.__updateOrders()
+
+    def __updateOrders(self):
+        with profiling.span("updateOrders.load"):
+            self.__loadState()
+            self.__startPlanner()
+        orders = self.orders
+        price_planner = self.price_planner
+        registry = self.registry
+
+        with profiling.span("updateOrders.discover"):
+            self.__discoverAlgorithms()
+
+        # Sweep a few more markets. Those found holding our orders are polled right away.
+        with profiling.span("updateOrders.sweep"):
+            self.__sweepMarkets()
+
+        # Only the markets due for a poll are fetched. Orders in the other markets
+        # keep their last snapshot, and the planner keeps working on them.
+        markets = self.markets()
+        available = [market for market in markets if not self.__marketTripped(market)]
+        polled = available if self.poller is None else self.poller.due(available)
+        CIRCUITS_OPEN.set(len(self.breakers.tripped()))
+        if not polled:
+            # Nothing to poll, but the planner may have sent changes since the last run
+            with profiling.span("updateOrders.persist"):
+                self.state_store.sync(orders)
+            return
+
+        # Fetch our orders and the market order books together
+        with profiling.span("updateOrders.fetch"), ThreadPoolExecutor(max_workers=2) as executor:
+            fetch = profiling.bind(self.__fetchPerMarket)
+            my_orders_future = executor.submit(fetch, self.getMyOrders, polled)
+            market_orders_future = executor.submit(fetch, self.getOrderBook, polled)
+            my_orders = my_orders_future.result()
+            market_orders = market_orders_future.result()
+
+        # Get all current orders. A market we couldn't read is left as it was.
+        with profiling.span("updateOrders.reconcile"):
+            current_orders = {}
+            for (location, algo), result in list(my_orders.items()):
+                if isinstance(result, Exception):
+                    print("Error: Could not get our orders in {} {}: {}".format(
+                            registry.locationName(location), registry.algoName(algo), str(result)))
+                    del my_orders[(location, algo)]
+                    continue
+                for order in result["orders"]:
+                    current = reconcile.parseOrder(order, location, algo)
+                    current_orders[current.id] = current
+
+            # Update the orders we are tracking with what changed since the last snapshot.
+            # Markets where orders came, went or lost hashrate are polled again soon.
+            moved = set()
+            tracked = {order_id: order for order_id, order in orders.items() if (order.location, order.algo) in my_orders}
+            added, removed, changed = reconcile.diffOrders(tracked, current_orders)
+            with price_planner.lock:
+                for order_id in removed:
+                    print("Order no longer exists: {}".format(order_id))
+                    price_planner.cancel(order_id)
+                    for gauge in [ORDER_PRICE, ORDER_TARGET, ORDER_DELTA]:
+                        gauge.remove(order=order_id, location=orders[order_id].location, algo=orders[order_id].algo)
+                    moved.add((orders[order_id].location, orders[order_id].algo))
+                    del orders[order_id]
+                for order_id in added:
+                    print("New order added: {}".format(order_id))
+                    orders[order_id] = current_orders[order_id]
+                    moved.add((orders[order_id].location, orders[order_id].algo))
+                for order_id, fields in changed.items():
+                    order = orders[order_id]
+                    if (fields.get("workers", order.workers) < order.workers
+                            or fields.get("accepted_speed", order.accepted_speed) < order.accepted_speed):
+                        moved.add((order.location, order.algo))
+                    order.update(fields)
+
+        # Find the lowest price thats has miners working for each algo in each location
+        with profiling.span("updateOrders.targets"):
+            target_prices = self.target_prices
+            floors = {}
+            for (location, algo), book in market_orders.items():
+                try:
+                    if isinstance(book, Exception):
+                        raise book
+                    # Get the target price and the floor of the working orders in this market, in one pass
+                    targets = book.targets(percentiles=(self.target_percentile,), depths=(self.target_depth,))
+                    target_price = book.pick(targets, self.target_strategy)
+                    floors[(location, algo)] = book.pick(targets, "minimum")
+                    if location not in target_prices:
+                        target_prices[location] = {}
+                    target_prices[location][algo] = round(target_price+self.target_min_add, 4)
+                except resilience.ApiError as e:
+                    print("Error: Could not get the order book of {} {}: {}".format(
+                            registry.locationName(location), registry.algoName(algo), str(e)))
+                except Exception as e:
+                    print("Error: {}".format(str(e)))
+                    print(traceback.print_exc())
+
+        # Plan the price changes that move each order to its target. Changes that are
+        # due now are sent here, later ones by the planner on its own timer.
+        with profiling.span("updateOrders.plan"):
+            now = datetime.now()
+            with price_planner.lock:
+                for order_id, order in orders.items():
+                    if (order.location, order.algo) not in my_orders:
+                        continue
+                    target_price = target_prices.get(order.location, {}).get(order.algo)
+                    if target_price is None:
+                        # The market's order book has never been read. Leave the order alone.
+                        order.change = "None: no target price for this market"
+                        continue
+                    order.target_price = target_price
+                    order.delta = order.price - order.target_price
+                    labels = {"order": order_id, "location": order.location, "algo": order.algo}
+                    ORDER_PRICE.labels(**labels).set(order.price)
+                    ORDER_TARGET.labels(**labels).set(order.target_price)
+                    ORDER_DELTA.labels(**labels).set(order.delta)
+                    reconcile.settlePending(order, now, self.pending_timeout)
+                    if order.pending_price is not None:
+                        # Poll again soon to see the change land
+                        moved.add((order.location, order.algo))
+                    if price_planner.inFlight(order_id):
+                        # The planner is sending a change from this price. Plan again once it lands.
+                        order.change = "None: price change in flight"
+                        continue
+                    steps = price_planner.plan(order_id, order, now, notify=False)
+                    if not steps:
+                        order.change = "None needed"
+                    else:
+                        order.change = "{} {} step(s), next at {}".format(
+                                steps[0].action.capitalize(), len(steps), steps[0].when.strftime("%H:%M:%S"))
+                due = price_planner.popDue(now)
+        with profiling.span("updateOrders.execute"):
+            price_planner.executeSteps(due)
+
+        # Set when each polled market is polled next
+        with profiling.span("updateOrders.schedule"):
+            if self.poller is not None:
+                for location, algo in polled:
+                    self.poller.observe((location, algo), target_prices.get(location, {}).get(algo),
+                            floors.get((location, algo)), (location, algo) in moved)
+
+        # Persist what changed this cycle
+        with profiling.span("updateOrders.persist"):
+            self.state_store.sync(orders)
+
+        ## Print Report
+
+        with profiling.span("updateOrders.report"):
+            print("##  Completed control loop: {} - {}".format(self.price_adjust_rate, datetime.now()))
+            print("##  Order book cache: {hits} hits, {misses} misses, {coalesced} coalesced".format(**self.order_book_cache.stats()))
+            tripped = self.breakers.tripped()
+            if tripped:
+                print("##  Circuit breakers not closed: {}".format(", ".join(
+                        "{} {} {} ({})".format(method, location, algo, state) for (method, location, algo), state in tripped.items())))
+            if self.poller is not None:
+                print("##  Polled {} of {} markets, next poll in {:.0f}s".format(
+                        len(polled), len(markets), max(0.0, self.poller.nextDue() - time.time())))
+            print("##")
+            print("#           |       |                  |  Current  |  Target  |          |  Price          ")
+            print("#     Id    |  Loc  |    Algorithm     |  Price    |  Price   |  Delta   |  Change         ")
+            print("  ----------|-------|------------------|-----------|----------|----------|-----------------------")
+            for order_id, order in orders.items():
+                # Orders restored from the state store have no target until their market is read
+                print("  {} {} {} {} {} {}   {}".format(
+                        str(order.id).center(10),
+                        registry.locationName(order.location).center(7),
+                        registry.algoName(order.algo).center(18),
+                        str(round(order.price, 4)).center(11),
+                        ("-" if order.target_price is None else str(round(order.target_price, 4))).center(10),
+                        ("-" if order.delta is None else str(round(order.delta, 4))).center(10),
+                        order.change or "",
+                    ))
+
+
+# Client built from config.toml on first use, for callers that only need one API key
+__client = None
+
+def getClient():
+    global __client
+    if __client is None:
+        __client = NicehashClient.from_config(toml.load("config.toml")['nicehash'])
+    return __client
+
+
+def updateOrders():
+    getClient().updateOrders()
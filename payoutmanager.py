@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import mwgrinpool
+import profiling
+
+
+PAYOUT_RESULTS = metrics.counter("pool_payout_results_total", "Pool payout results per account", ["status"])
+
+
+# Runs the payouts of many pool accounts concurrently, up to max_workers at once.
+# HTTP stages overlap freely; the wallet signs one slate at a time (see grinwallet.Wallet).
+# Each account's output is printed in one piece when its payout finishes.
+class PayoutManager:
+    def __init__(self, accounts, max_workers=4):
+        self.accounts = accounts
+        self.max_workers = max(1, int(max_workers))
+        self.print_lock = threading.Lock()
+
+    # Build the manager from a full config.toml. Accounts are listed as
+    # [[mwgrinpool.accounts]] tables; a single USERNAME/PASSWORD in [mwgrinpool] also works.
+    @classmethod
+    def from_config(cls, config):
+        pool_config = config['mwgrinpool']
+        wallet_config = config.get('wallet', {})
+        accounts = list(pool_config.get('accounts', []))
+        if not accounts and pool_config.get('USERNAME'):
+            accounts = [{"USERNAME": pool_config['USERNAME'], "PASSWORD": pool_config['PASSWORD']}]
+
+        wallet_options = {
+            "listen_port": wallet_config.get('LISTEN_PORT', 3415),
+            "foreign_secret": wallet_config.get('FOREIGN_API_SECRET'),
+            "owner_url": wallet_config.get('OWNER_API_URL'),
+            "owner_secret": wallet_config.get('OWNER_API_SECRET'),
+        }
+        settings = []
+        for account in accounts:
+            settings.append({
+                "url": account.get('URL', pool_config.get('URL')),
+                "username": account['USERNAME'],
+                "password": account['PASSWORD'],
+                "wallet_pass": account.get('WALLET_PASSWORD', wallet_config.get('PASSWORD', "")),
+                "wallet_backend": account.get('WALLET_BACKEND', wallet_config.get('BACKEND', "rpc")),
+                "wallet_options": wallet_options,
+                "journal_dir": pool_config.get('JOURNAL_DIR'),
+                "state_file": pool_config.get('STATE_FILE'),
+                "max_poll_wait": pool_config.get('MAX_POLL_MINUTES'),
+            })
+        return cls(settings, pool_config.get('MAX_CONCURRENT_PAYOUTS', 4))
+
+    def __payout(self, account):
+        payout = mwgrinpool.Pool_Payout()
+        if account.get("url"):
+            payout.mwURL = account["url"]
+        if account.get("journal_dir"):
+            payout.journal_dir = account["journal_dir"]
+        if account.get("state_file"):
+            payout.state_file = account["state_file"]
+        if account.get("max_poll_wait") is not None:
+            payout.MAX_POLL_WAIT = 60 * account["max_poll_wait"]
+        payout.username = account["username"]
+        payout.password = account["password"]
+        payout.wallet_pass = account["wallet_pass"]
+        payout.wallet_backend = account["wallet_backend"]
+        payout.wallet_options = account["wallet_options"]
+        payout.output = io.StringIO()
+        try:
+            result = payout.run_local_wallet()
+        except Exception as e:
+            result = mwgrinpool.PayoutResult(account["username"], mwgrinpool.FAILED, str(e))
+        PAYOUT_RESULTS.labels(status=result.status).inc()
+        with self.print_lock:
+            sys.stdout.write("Pool payout for {}:\n{}".format(account["username"], payout.output.getvalue()))
+            sys.stdout.flush()
+        return result
+
+    # Run every account's payout. Returns a PayoutResult per account, in account order.
+    def run(self):
+        if not self.accounts:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(profiling.bind(self.__payout), self.accounts))
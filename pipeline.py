@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import queue
+import threading
+import metrics
+
+
+STAGE_DURATION = metrics.histogram("pipeline_stage_seconds", "Time an item spent in each pipeline stage", ["pipeline", "stage"])
+STAGE_ERRORS = metrics.counter("pipeline_stage_errors_total", "Items that failed in each pipeline stage", ["pipeline", "stage"])
+QUEUE_DEPTH = metrics.gauge("pipeline_queue_depth", "Items waiting for each pipeline stage", ["pipeline", "stage"])
+
+_STOP = object()     # Tells a stage worker to exit
+
+
+# One step of a pipeline. func(item) does the work and returns the item for the next
+# stage, or None to drop it. workers threads run the stage, so that many items can
+# be in it at once.
+class Stage:
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.threads = []
+
+
+# Runs items through a list of stages, each on its own threads, so every stage
+# can work on a different item at the same time. Stages are joined by bounded
+# queues: when a stage falls behind, the stage before it blocks (and so does
+# submit) instead of piling up work.
+#   on_done(item)                  called when an item leaves the last stage
+#   on_error(item, stage, error)   called when a stage raises; the item is dropped
+class Pipeline:
+    def __init__(self, name, stages, queue_size=4, on_done=None, on_error=None):
+        self.name = name
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, int(queue_size))) for stage in stages]
+        self.on_done = on_done
+        self.on_error = on_error
+        self.started = False
+        self.lock = threading.Lock()
+
+    def __worker(self, index):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = inbox.get()
+            QUEUE_DEPTH.labels(pipeline=self.name, stage=stage.name).set(inbox.qsize())
+            if item is _STOP:
+                return
+            try:
+                with STAGE_DURATION.labels(pipeline=self.name, stage=stage.name).time():
+                    item = stage.func(item)
+            except Exception as e:
+                STAGE_ERRORS.labels(pipeline=self.name, stage=stage.name).inc()
+                if self.on_error is not None:
+                    self.on_error(item, stage.name, e)
+                continue
+            if item is None:
+                continue
+            if outbox is not None:
+                outbox.put(item)
+                QUEUE_DEPTH.labels(pipeline=self.name, stage=self.stages[index + 1].name).set(outbox.qsize())
+            elif self.on_done is not None:
+                self.on_done(item)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return self
+            for index, stage in enumerate(self.stages):
+                for i in range(stage.workers):
+                    thread = threading.Thread(target=self.__worker, args=(index,),
+                            name="{}-{}-{}".format(self.name, stage.name, i), daemon=True)
+                    thread.start()
+                    stage.threads.append(thread)
+            self.started = True
+        return self
+
+    # Add an item to the first stage. Blocks while the first queue is full, up to
+    # timeout seconds. Returns False if it timed out.
+    def submit(self, item, timeout=None):
+        self.start()
+        try:
+            self.queues[0].put(item, timeout=timeout)
+        except queue.Full:
+            return False
+        QUEUE_DEPTH.labels(pipeline=self.name, stage=self.stages[0].name).set(self.queues[0].qsize())
+        return True
+
+    # Items waiting for each stage
+    def depths(self):
+        return {stage.name: inbox.qsize() for stage, inbox in zip(self.stages, self.queues)}
+
+    # Let every item already submitted finish, then stop the threads. Gives up after
+    # timeout seconds, leaving the (daemon) threads with whatever they still hold.
+    # Returns False if it gave up.
+    def close(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        with self.lock:
+            if not self.started:
+                return True
+            for stage, inbox in zip(self.stages, self.queues):
+                try:
+                    for thread in stage.threads:
+                        inbox.put(_STOP, timeout=remaining())
+                except queue.Full:
+                    return False
+                for thread in stage.threads:
+                    thread.join(remaining())
+                    if thread.is_alive():
+                        return False
+                stage.threads = []
+            self.started = False
+        return True
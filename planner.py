@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Price change actions
+DECREASE = "decrease"
+INCREASE = "increase"
+
+# Prices closer than this are considered equal
+PRICE_EPSILON = 0.00000001
+
+
+# One scheduled price change
+class Step:
+    __slots__ = ["when", "action", "price"]
+
+    def __init__(self, when, action, price):
+        self.when = when
+        self.action = action
+        self.price = price
+
+
+# Compute the fastest legal schedule of price changes from price to target.
+# Decreases lower the price by decrease_step and must be decrease_cooldown apart.
+# Increases may raise the price by at most max_increase, one every increase_interval.
+# Decreases never go below the target; a remainder smaller than one step is left.
+def planSchedule(price, target, now, last_decreased, last_increased, decrease_step, decrease_cooldown,
+                 max_increase, increase_interval):
+    steps = []
+    if price - target > PRICE_EPSILON:
+        count = int(math.floor((price - target) / decrease_step + PRICE_EPSILON))
+        when = max(now, last_decreased + decrease_cooldown)
+        for i in range(count):
+            price = round(price - decrease_step, 8)
+            steps.append(Step(when + i * decrease_cooldown, DECREASE, price))
+    elif target - price > PRICE_EPSILON:
+        count = int(math.ceil((target - price) / max_increase - PRICE_EPSILON))
+        when = max(now, last_increased + increase_interval)
+        for i in range(count):
+            price = round(min(price + max_increase, target), 8)
+            steps.append(Step(when + i * increase_interval, INCREASE, price))
+    return steps
+
+
+# Runs the price change schedule of every order on its own timer thread.
+# execute(order_id, order, action, price) sends one change and returns True on success.
+# A failed step drops the rest of that order's plan until it is planned again.
+# An order is in flight from the moment its step is taken until the call returns,
+# and is neither planned again nor given another step until then.
+class PricePlanner:
+    def __init__(self, execute, decrease_step, decrease_cooldown, max_increase, increase_interval, max_workers=8):
+        self.execute = execute
+        self.decrease_step = decrease_step
+        self.decrease_cooldown = decrease_cooldown
+        self.max_increase = max_increase
+        self.increase_interval = increase_interval
+        self.max_workers = max_workers
+        self.plans = {}     # order_id -> (order, [Step])
+        self.in_flight = set()  # order_ids whose step is being sent
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+        self.running = False
+
+    # Replace the plan for an order, from its current (or pending) price to its target price
+    def plan(self, order_id, order, now=None, notify=True):
+        if now is None:
+            now = datetime.now()
+        price = order.pending_price
+        if price is None:
+            price = order.price
+        steps = planSchedule(price, order.target_price, now, order.last_decreased, order.last_increased,
+                self.decrease_step, self.decrease_cooldown, self.max_increase, self.increase_interval)
+        with self.lock:
+            if order_id in self.in_flight:
+                return []
+            if steps:
+                self.plans[order_id] = (order, steps)
+            else:
+                self.plans.pop(order_id, None)
+            if notify:
+                self.wakeup.notify()
+        return steps
+
+    def cancel(self, order_id):
+        with self.lock:
+            self.plans.pop(order_id, None)
+
+    # Is a step of the order being sent?
+    def inFlight(self, order_id):
+        with self.lock:
+            return order_id in self.in_flight
+
+    # Remaining steps for an order
+    def steps(self, order_id):
+        with self.lock:
+            return list(self.plans.get(order_id, (None, []))[1])
+
+    # Take every step that is due off its plan, and mark its order in flight
+    # until executeSteps has sent it. Returns [(order_id, order, Step)]
+    def popDue(self, now=None):
+        if now is None:
+            now = datetime.now()
+        due = []
+        with self.lock:
+            for order_id, (order, steps) in self.plans.items():
+                if steps and steps[0].when <= now and order_id not in self.in_flight:
+                    self.in_flight.add(order_id)
+                    due.append((order_id, order, steps.pop(0)))
+            for order_id in [order_id for order_id, (order, steps) in self.plans.items() if not steps]:
+                del self.plans[order_id]
+        return due
+
+    # Execute steps taken by popDue, concurrently across orders
+    def executeSteps(self, due):
+        def run(item):
+            order_id, order, step = item
+            sent = False
+            try:
+                sent = self.execute(order_id, order, step.action, step.price)
+            finally:
+                with self.lock:
+                    if not sent:
+                        self.plans.pop(order_id, None)
+                    self.in_flight.discard(order_id)
+        if due:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(run, due))
+        with self.lock:
+            self.wakeup.notify()
+
+    # Execute every step that is due. Returns the number sent.
+    def runDue(self, now=None):
+        due = self.popDue(now)
+        self.executeSteps(due)
+        return len(due)
+
+    # Time the next step is due, or None
+    def nextDue(self):
+        with self.lock:
+            times = [steps[0].when for order_id, (order, steps) in self.plans.items()
+                    if steps and order_id not in self.in_flight]
+            return min(times) if times else None
+
+    def __run(self):
+        while True:
+            with self.lock:
+                if not self.running:
+                    return
+                next_due = self.nextDue()
+                wait = None if next_due is None else (next_due - datetime.now()).total_seconds()
+                if wait is None or wait > 0:
+                    self.wakeup.wait(wait)
+                    continue
+            try:
+                self.runDue()
+            except Exception as e:
+                print("Error: price planner: {}".format(str(e)))
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.__run, name="price-planner", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+
+MAX_SAMPLES = 24        # Balance samples kept per account for the rate estimate
+SAFETY_FACTOR = 0.8     # Poll again after this fraction of the predicted wait
+
+
+# Estimate the time a balance reaches minimum, from (time, balance) samples.
+# Fits a least squares line through the samples. Returns None if the balance isn't growing.
+def predictTime(samples, minimum):
+    if len(samples) < 2:
+        return None
+    n = float(len(samples))
+    mean_t = sum(t for t, b in samples) / n
+    mean_b = sum(b for t, b in samples) / n
+    var_t = sum((t - mean_t) ** 2 for t, b in samples)
+    if var_t <= 0:
+        return None
+    rate = sum((t - mean_t) * (b - mean_b) for t, b in samples) / var_t
+    if rate <= 0:
+        return None
+    last_t, last_b = samples[-1]
+    return last_t + max(0.0, minimum - last_b) / rate
+
+
+# Per account pool state kept across restarts: the cached user_id and recent balances.
+# Shared by every payout using the same file; see get().
+class PoolState:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.accounts = {}
+        try:
+            with open(path, "r") as f:
+                self.accounts = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    @staticmethod
+    def key(url, username):
+        return "{} {}".format(url, username)
+
+    def __save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".pool_state.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.accounts, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def __account(self, key):
+        return self.accounts.setdefault(key, {"user_id": None, "samples": [], "etag": None})
+
+    def getUserId(self, key):
+        with self.lock:
+            return self.accounts.get(key, {}).get("user_id")
+
+    def setUserId(self, key, user_id):
+        with self.lock:
+            account = self.__account(key)
+            if account["user_id"] != user_id:
+                account["user_id"] = user_id
+                account["samples"] = []
+                account["etag"] = None
+                self.__save()
+
+    # The last balance seen and its ETag, or None for either
+    def lastBalance(self, key):
+        with self.lock:
+            account = self.accounts.get(key, {})
+            samples = account.get("samples", [])
+            return (samples[-1][1] if samples else None), account.get("etag")
+
+    # Record a balance. A drop means a payout happened, so the history starts over.
+    def recordBalance(self, key, balance, now=None, etag=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            account = self.__account(key)
+            samples = account["samples"]
+            if samples and balance < samples[-1][1]:
+                del samples[:]
+            samples.append([now, balance])
+            del samples[:-MAX_SAMPLES]
+            account["etag"] = etag
+            self.__save()
+
+    # Time the balance should next be checked, to catch it reaching minimum
+    def nextPoll(self, key, minimum, max_wait):
+        with self.lock:
+            samples = [tuple(sample) for sample in self.accounts.get(key, {}).get("samples", [])]
+        if not samples:
+            return 0.0
+        last_t, last_b = samples[-1]
+        if last_b >= minimum:
+            return 0.0
+        eta = predictTime(samples, minimum)
+        if eta is None:
+            return 0.0
+        return last_t + min((eta - last_t) * SAFETY_FACTOR, max_wait)
+
+
+__states = {}
+__states_lock = threading.Lock()
+
+
+# The shared PoolState for a file
+def get(path):
+    path = os.path.abspath(path)
+    with __states_lock:
+        state = __states.get(path)
+        if state is None:
+            state = __states[path] = PoolState(path)
+        return state
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+
+# An order is considered "working" when it has miners delivering hashrate to it
+MIN_WORKERS = 3
+MIN_ACCEPTED_SPEED = 0.00000005
+STANDARD_ORDER = 0
+
+STRATEGIES = ["minimum", "weighted", "percentile", "depth"]
+
+
+# One market order book, held as column arrays
+class OrderBook:
+    def __init__(self, price, limit_speed, accepted_speed, workers, type):
+        self.price = price
+        self.limit_speed = limit_speed
+        self.accepted_speed = accepted_speed
+        self.workers = workers
+        self.type = type
+
+    # Load the "orders" list of an orders.get response
+    @classmethod
+    def from_orders(cls, orders):
+        return cls(
+                np.array([o["price"] for o in orders], dtype=np.float64),
+                np.array([o["limit_speed"] for o in orders], dtype=np.float64),
+                np.array([o["accepted_speed"] for o in orders], dtype=np.float64),
+                np.array([o["workers"] for o in orders], dtype=np.int64),
+                np.array([o["type"] for o in orders], dtype=np.int8),
+            )
+
+    def __len__(self):
+        return self.price.size
+
+    # Boolean mask of the standard orders that have miners working on them
+    def working(self):
+        return ((self.workers >= MIN_WORKERS)
+                & (self.accepted_speed > MIN_ACCEPTED_SPEED)
+                & (self.type == STANDARD_ORDER))
+
+    # Compute every target price in one pass over the working orders.
+    #   minimum:    lowest price with miners working on it
+    #   weighted:   average price, weighted by accepted hashrate
+    #   percentile: price percentiles, one per entry in percentiles
+    #   depth:      one per entry in depths. Walking down from the most expensive
+    #               order, the price at which the accepted hashrate of all orders
+    #               priced at or above it first reaches the depth. Books shallower
+    #               than the depth give the minimum.
+    def targets(self, percentiles=(), depths=()):
+        mask = self.working()
+        price = self.price[mask]
+        if price.size == 0:
+            raise ValueError("No working orders in order book")
+        speed = self.accepted_speed[mask]
+
+        descending = np.argsort(price, kind="stable")[::-1]
+        price_desc = price[descending]
+        cumulative = np.cumsum(speed[descending])
+        total = cumulative[-1]
+
+        depth_idx = np.searchsorted(cumulative, np.asarray(depths, dtype=np.float64), side="left")
+        depth_idx = np.minimum(depth_idx, price.size - 1)
+
+        return {
+            "minimum": price_desc[-1],
+            "weighted": np.dot(price, speed) / total if total > 0 else price.mean(),
+            "percentile": np.percentile(price, percentiles) if len(percentiles) else np.empty(0),
+            "depth": price_desc[depth_idx],
+        }
+
+    # A single target price for the named strategy
+    def target(self, strategy="minimum", percentile=10, depth=0.0):
+        return self.pick(self.targets(percentiles=(percentile,), depths=(depth,)), strategy)
+
+    # The target price of the named strategy from a targets() result, taking the
+    # first percentile or depth asked for
+    @staticmethod
+    def pick(targets, strategy):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown target strategy: {}".format(strategy))
+        if strategy in ["percentile", "depth"]:
+            return float(targets[strategy][0])
+        return float(targets[strategy])
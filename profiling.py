@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Profiling of scheduled task runs ("cycles").
+# Each cycle records cProfile stats of the task thread, tracemalloc memory use
+# and wall clock spans marked in the code with span(). Cycles are dumped to
+# DIRECTORY/<task>/, keeping the newest few, and summarize() reports the hot
+# spots across every dump kept.
+#
+#   ./profiling.py profile --top 25
+
+import os
+import sys
+import json
+import time
+import pstats
+import argparse
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime
+
+
+_local = threading.local()
+
+
+# The spans recorded during one cycle
+class Cycle:
+    def __init__(self, task):
+        self.task = task
+        self.start = time.perf_counter()
+        self.spans = []         # [name, seconds from cycle start, duration]
+        self.lock = threading.Lock()
+
+    def add(self, name, start, duration):
+        with self.lock:
+            self.spans.append([name, start - self.start, duration])
+
+
+# Time a block of code as part of the current cycle. Does nothing outside a cycle.
+@contextlib.contextmanager
+def span(name):
+    cycle = getattr(_local, "cycle", None)
+    if cycle is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        cycle.add(name, start, time.perf_counter() - start)
+
+
+# Wrap func so spans it records on another thread count toward the caller's cycle
+def bind(func):
+    cycle = getattr(_local, "cycle", None)
+    if cycle is None:
+        return func
+    def bound(*args, **kwargs):
+        previous = getattr(_local, "cycle", None)
+        _local.cycle = cycle
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.cycle = previous
+    return bound
+
+
+# Records cycles to directory, keeping the newest keep dumps of each task.
+# cProfile sees only the task's own thread; work it hands to other threads shows
+# up through the spans recorded there (see bind). tracemalloc is process-wide, so
+# cycles run one at a time: a task due while another is profiled waits for it.
+class Profiler:
+    def __init__(self, directory="profile", keep=20, memory=True, top_allocations=10):
+        self.directory = directory
+        self.keep = max(1, int(keep))
+        self.memory = memory
+        self.top_allocations = top_allocations
+        self.lock = threading.Lock()    # Held for the whole of each cycle
+        os.makedirs(directory, exist_ok=True)
+
+    # Run func() as one cycle of task
+    def run(self, task, func):
+        with self.cycle(task):
+            return func()
+
+    @contextlib.contextmanager
+    def cycle(self, task):
+        with self.lock:
+            with self.__cycle(task) as cycle:
+                yield cycle
+
+    @contextlib.contextmanager
+    def __cycle(self, task):
+        cycle = Cycle(task)
+        _local.cycle = cycle
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Only one profiler may be active at a time on some Python versions
+            profile = None
+        started = datetime.now()
+        error = None
+        try:
+            yield cycle
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            _local.cycle = None
+            self.__dump(cycle, started, time.perf_counter() - cycle.start, profile, error)
+
+    def __dump(self, cycle, started, wall, profile, error):
+        record = {
+            "task": cycle.task,
+            "started": started.isoformat(),
+            "wall": wall,
+            "error": error,
+            "spans": cycle.spans,
+        }
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            record["memory"] = {
+                "current": current,
+                "peak": peak,
+                "top": [[str(stat.traceback[0]), stat.size, stat.count]
+                        for stat in snapshot.statistics("lineno")[:self.top_allocations]],
+            }
+        directory = os.path.join(self.directory, cycle.task)
+        os.makedirs(directory, exist_ok=True)
+        name = started.strftime("%Y%m%d-%H%M%S-%f")
+        with open(os.path.join(directory, name + ".json"), "w") as f:
+            json.dump(record, f)
+        if profile is not None:
+            profile.dump_stats(os.path.join(directory, name + ".prof"))
+        self.__rotate(directory)
+
+    # Delete all but the newest keep cycles
+    def __rotate(self, directory):
+        names = sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json"))
+        for name in names[:-self.keep]:
+            for extension in [".json", ".prof"]:
+                try:
+                    os.remove(os.path.join(directory, name + extension))
+                except FileNotFoundError:
+                    pass
+
+
+# Report the hot spots across every cycle dumped in directory
+def summarize(directory, top=20, out=sys.stdout):
+    if not os.path.isdir(directory):
+        print("No profile dumps in {}".format(directory), file=out)
+        return
+    for task in sorted(os.listdir(directory)):
+        task_dir = os.path.join(directory, task)
+        if not os.path.isdir(task_dir):
+            continue
+        records = []
+        profiles = []
+        for name in sorted(os.listdir(task_dir)):
+            path = os.path.join(task_dir, name)
+            if name.endswith(".json"):
+                with open(path, "r") as f:
+                    records.append(json.load(f))
+            elif name.endswith(".prof"):
+                profiles.append(path)
+        if not records:
+            continue
+
+        walls = [record["wall"] for record in records]
+        print("##  Task {}: {} cycles, wall mean {:.3f}s, max {:.3f}s".format(
+                task, len(records), sum(walls) / len(walls), max(walls)), file=out)
+        peaks = [record["memory"]["peak"] for record in records if "memory" in record]
+        if peaks:
+            print("##  Peak memory mean {:.1f} MB, max {:.1f} MB".format(
+                    sum(peaks) / len(peaks) / 1048576.0, max(peaks) / 1048576.0), file=out)
+
+        # Spans: total time in each, across every cycle
+        spans = {}
+        for record in records:
+            for name, start, duration in record["spans"]:
+                total = spans.setdefault(name, [0, 0.0, 0.0])
+                total[0] += 1
+                total[1] += duration
+                total[2] = max(total[2], duration)
+        if spans:
+            print("#   Span                        |  Count |  Total s |  Mean s  |  Max s", file=out)
+            print("  ------------------------------|--------|----------|----------|---------", file=out)
+            for name, (count, total, longest) in sorted(spans.items(), key=lambda item: -item[1][1])[:top]:
+                print("  {} {} {} {} {}".format(
+                        name.ljust(30),
+                        str(count).rjust(6),
+                        "{:.3f}".format(total).rjust(10),
+                        "{:.4f}".format(total / count).rjust(10),
+                        "{:.4f}".format(longest).rjust(9),
+                    ), file=out)
+
+        # Functions: cProfile stats of every cycle, merged
+        if profiles:
+            print("##  Hot spots by own time, {} cycles merged".format(len(profiles)), file=out)
+            stats = pstats.Stats(profiles[0], stream=out)
+            for path in profiles[1:]:
+                stats.add(path)
+            stats.strip_dirs().sort_stats("tottime").print_stats(top)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the profile dumps written by hashmanager.py --profile")
+    parser.add_argument("directory", nargs="?", default="profile")
+    parser.add_argument("--top", type=int, default=20, help="spans and functions to list")
+    args = parser.parse_args()
+    summarize(args.directory, args.top)
+    sys.exit(0)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime
+
+
+# Order fields we track from orders.get&my, and how to parse them
+TRACKED_FIELDS = {
+    "limit_speed": float,
+    "alive": bool,
+    "price": float,
+    "workers": int,
+    "accepted_speed": float,
+}
+
+# Prices closer than this are considered equal
+PRICE_EPSILON = 0.00000001
+
+# last_decreased (or last_increased) of an order that was never decreased (or increased)
+NEVER = datetime(1970, 1, 1)
+
+
+# One of our orders. Numeric fields are parsed once, when the order is read from the API.
+class Order:
+    __slots__ = ["id", "location", "algo", "price", "limit_speed", "alive", "workers", "accepted_speed",
+                 "last_decreased", "last_increased", "pending_price", "pending_since", "target_price", "delta", "change"]
+
+    def __init__(self, id, location, algo, price=0.0, limit_speed=0.0, alive=False, workers=0, accepted_speed=0.0,
+                 last_decreased=NEVER, last_increased=NEVER, pending_price=None, pending_since=None):
+        self.id = id
+        self.location = location
+        self.algo = algo
+        self.price = price
+        self.limit_speed = limit_speed
+        self.alive = alive
+        self.workers = workers
+        self.accepted_speed = accepted_speed
+        self.last_decreased = last_decreased
+        self.last_increased = last_increased
+        self.pending_price = pending_price      # Price sent but not yet seen in a snapshot
+        self.pending_since = pending_since
+        self.target_price = None
+        self.delta = None
+        self.change = None                      # Description of the last change, for the report
+
+    def __repr__(self):
+        return "Order({})".format(", ".join("{}={!r}".format(field, getattr(self, field)) for field in self.__slots__))
+
+    def update(self, fields):
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+
+# Parse an orders.get&my order of one market
+def parseOrder(order, location, algo):
+    fields = {field: parse(order[field]) for field, parse in TRACKED_FIELDS.items()}
+    return Order(int(order["id"]), int(location), int(algo), **fields)
+
+
+# Compare the tracked orders to a new snapshot {order_id: Order}.
+# Returns (added ids, removed ids, {order_id: {field: new value}} for changed orders)
+def diffOrders(tracked, snapshot):
+    added = [order_id for order_id in snapshot if order_id not in tracked]
+    removed = [order_id for order_id in tracked if order_id not in snapshot]
+    changed = {}
+    for order_id, new in snapshot.items():
+        old = tracked.get(order_id)
+        if old is None:
+            continue
+        fields = {}
+        for field in TRACKED_FIELDS:
+            value = getattr(new, field)
+            if getattr(old, field) != value:
+                fields[field] = value
+        if fields:
+            changed[order_id] = fields
+    return added, removed, changed
+
+
+# Clear an order's in-flight price change once the new price shows up, or once it expires
+def settlePending(order, now, timeout):
+    expected = order.pending_price
+    if expected is None:
+        return
+    if abs(order.price - expected) < PRICE_EPSILON or now - order.pending_since > timeout:
+        order.pending_price = None
+        order.pending_since = None
+
+
+# Record a price change that has been sent but not yet seen in a snapshot
+def markPending(order, expected_price, now):
+    order.pending_price = expected_price
+    order.pending_since = now
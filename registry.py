@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+
+# Location Numbers (as defined: https://www.nicehash.com/doc-api)
+# 0 for Europe (NiceHash), 1 for USA (WestHash). The legacy API has no call listing them.
+LOCATIONS = {
+        "EU": 0,
+        "US": 1,
+    }
+
+# Algorithms known before the first discovery, or when it fails
+ALGOS = {
+        "GrinCuckaroo29": 38,
+        "GrinCuckaroo31": 39,
+    }
+
+# Held while a registry file is read and rewritten, so registries of different
+# API keys sharing a file don't drop each other's markets
+_file_lock = threading.Lock()
+
+
+# Parse a location or algorithm number given as a number or a string. None if it isn't one.
+def _number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# The NiceHash algorithms and locations, indexed both ways, and the markets
+# (location, algo) we hold orders in. Kept in a JSON file across restarts:
+#   algorithms  discovered from buy.info, refreshed after ttl seconds
+#   markets     with our orders, found by a sweep of every market, started again sweep_interval seconds
+#               after the last one finished. A sweep is taken a few markets at a time (nextSweep,
+#               sweepResults). Markets an order was just placed in can be added between sweeps.
+# The markets are kept per API key given as api_id, so clients of different keys can share the file.
+# Pass path=None to keep everything in memory.
+class MarketRegistry:
+    def __init__(self, path=None, ttl=86400.0, sweep_interval=3600.0, api_id=""):
+        self.path = path
+        self.api_id = str(api_id)
+        self.ttl = float(ttl)
+        self.sweep_interval = float(sweep_interval)
+        self.lock = threading.Lock()
+        self.locations = dict(LOCATIONS)    # name -> number
+        self.location_names = {number: name for name, number in LOCATIONS.items()}
+        self.algos = {}                     # name -> number
+        self.algo_names = {}                # number -> name
+        self.discovered_at = 0.0            # When the algorithms were last discovered
+        self.active = set()                 # (location, algo) markets holding our orders
+        self.swept_at = 0.0                 # When the last sweep finished
+        self.sweep_pending = []             # Markets the sweep in progress hasn't checked yet
+        self.sweep_found = set()            # Markets it found our orders in, or couldn't read while active
+        self.sweeping = False
+        self.loaded = False
+        self.__index(ALGOS)
+
+    def __index(self, algos):
+        self.algos = dict(algos)
+        self.algo_names = {number: name for name, number in algos.items()}
+
+    # Read the file once, if there is one. A missing or unreadable file leaves the defaults.
+    def load(self):
+        if self.loaded:
+            return self
+        self.loaded = True
+        if self.path is None:
+            return self
+        with _file_lock:
+            saved = self.__read()
+        with self.lock:
+            if saved.get("algorithms"):
+                self.__index({name: int(number) for name, number in saved["algorithms"].items()})
+                self.discovered_at = float(saved.get("discovered_at", 0.0))
+            self.active = {(int(location), int(algo)) for location, algo in saved["active"].get(self.api_id, [])}
+            self.swept_at = float(saved["swept_at"].get(self.api_id, 0.0))
+        return self
+
+    # The file contents, with the markets of each key. Files from before markets were
+    # kept per key have one list of markets, which goes to the key that reads it.
+    def __read(self):
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        if not isinstance(saved.get("active"), dict):
+            saved["active"] = {self.api_id: saved.get("active", [])}
+            saved["swept_at"] = {self.api_id: saved.get("swept_at", 0.0)}
+        return saved
+
+    # Rewrite the file with our algorithms and markets, keeping the markets of other keys
+    def __save(self):
+        if self.path is None:
+            return
+        with _file_lock:
+            saved = self.__read()
+            saved["algorithms"] = self.algos
+            saved["discovered_at"] = self.discovered_at
+            saved["active"][self.api_id] = sorted(self.active)
+            saved["swept_at"][self.api_id] = self.swept_at
+            self.__write(saved)
+
+    def __write(self, saved):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".registry.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    # Are the algorithms older than the TTL?
+    def stale(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return now - self.discovered_at >= self.ttl
+
+    # Replace the algorithms with {name: number} from a discovery
+    def setAlgorithms(self, algos, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.__index(algos)
+            self.discovered_at = now
+            self.__save()
+
+    # Up to count markets for the sweep to check next, starting a sweep once one is due.
+    # Returns [] when no sweep is going on.
+    def nextSweep(self, count, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.sweeping:
+                if now - self.swept_at < self.sweep_interval:
+                    return []
+                self.sweeping = True
+                self.sweep_pending = [(location, algo) for location in sorted(self.location_names)
+                        for algo in sorted(self.algo_names)]
+                self.sweep_found = set()
+            return self.sweep_pending[:max(0, int(count))]
+
+    # Record what the sweep found, {market: True if it holds our orders, False if not,
+    # None if it couldn't be read}. A market found is active at once; markets found
+    # empty are dropped when the sweep finishes. Returns True if it just finished.
+    def sweepResults(self, results, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.sweeping:
+                return False
+            for market, found in results.items():
+                if found or (found is None and market in self.active):
+                    self.sweep_found.add(market)
+            self.sweep_pending = [market for market in self.sweep_pending if market not in results]
+            added = {market for market, found in results.items() if found} - self.active
+            self.active.update(added)
+            if self.sweep_pending:
+                if added:
+                    self.__save()
+                return False
+            self.active = self.sweep_found
+            self.sweeping = False
+            self.swept_at = now
+            self.__save()
+            return True
+
+    # Add markets holding our orders between sweeps, e.g. one an order was just placed in
+    def addActive(self, markets):
+        with self.lock:
+            if self.sweeping:
+                self.sweep_found.update(markets)
+            markets = set(markets) - self.active
+            if markets:
+                self.active.update(markets)
+                self.__save()
+
+    # The markets holding our orders, as of the last sweep
+    def activeMarkets(self):
+        with self.lock:
+            return sorted(self.active)
+
+    def locationName(self, number):
+        name = self.location_names.get(_number(number))
+        return name if name is not None else str(number)
+
+    def algoName(self, number):
+        name = self.algo_names.get(_number(number))
+        return name if name is not None else str(number)
+
+    # Number of a location or algorithm by name, or None
+    def location(self, name):
+        return self.locations.get(name)
+
+    def algo(self, name):
+        return self.algos.get(name)
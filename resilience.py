@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import random
+import threading
+import requests
+
+
+# Error kinds, also used as metric labels
+RATE_LIMIT = "rate_limit"   # Rejected for sending too much. Nothing was done; retry after a pause.
+TRANSIENT = "transient"     # Network or server trouble. May work on retry.
+FATAL = "fatal"             # The request itself is wrong. Retrying won't help.
+CIRCUIT_OPEN = "circuit_open"
+
+# Words in NiceHash error messages that mean we are sending too much
+RATE_LIMIT_MESSAGES = ["limit", "too many", "try again later"]
+
+
+# An API call that failed, with the kind of failure
+class ApiError(Exception):
+    def __init__(self, message, kind=FATAL):
+        super().__init__(message)
+        self.kind = kind
+
+
+# The circuit breaker for the call is open, so it wasn't sent
+class CircuitOpenError(ApiError):
+    def __init__(self, message):
+        super().__init__(message, CIRCUIT_OPEN)
+
+
+# The kind of an HTTP status code
+def classifyStatus(status_code):
+    if status_code == 429:
+        return RATE_LIMIT
+    if status_code >= 500 or status_code in [408, 409]:
+        return TRANSIENT
+    return FATAL
+
+
+# The kind of an "error" message in an API result
+def classifyMessage(message):
+    text = str(message).lower()
+    if any(word in text for word in RATE_LIMIT_MESSAGES):
+        return RATE_LIMIT
+    return FATAL
+
+
+# The kind of any exception raised by an API call
+def classify(e):
+    if isinstance(e, ApiError):
+        return e.kind
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return TRANSIENT
+    return FATAL
+
+
+# Seconds to sleep before retry number attempt (from 0): "full jitter" exponential backoff
+def backoff(attempt, base=0.5, cap=30.0):
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# Call func, retrying the kinds of failure in retry_kinds up to retries times with backoff
+def retry(func, retries=2, base=0.5, cap=30.0, retry_kinds=(RATE_LIMIT, TRANSIENT)):
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or classify(e) not in retry_kinds:
+                raise
+        time.sleep(backoff(attempt, base, cap))
+        attempt += 1
+
+
+# Stops calls to something that keeps failing.
+# After failure_threshold failures in a row the breaker opens and calls fail at once.
+# After reset_timeout seconds one trial call is let through (half open): success
+# closes the breaker, failure opens it again.
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=300.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    # True while calls would be refused. Doesn't change the state.
+    def isOpen(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.state == self.OPEN:
+                return now - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN
+
+    # May a call go through now? Lets one trial call through once the timeout is up.
+    def allow(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = now
+
+
+# A CircuitBreaker for each key, created on first use
+class Breakers:
+    def __init__(self, failure_threshold=3, reset_timeout=300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    # Keys whose breaker is not closed, with the state
+    def tripped(self):
+        with self.lock:
+            return {key: breaker.state for key, breaker in self.breakers.items() if breaker.state != CircuitBreaker.CLOSED}
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import random
+import asyncio
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+# What to do when a task is due while its previous run is still going
+OVERLAP_SKIP = "skip"       # Drop this run
+OVERLAP_WAIT = "wait"       # Start as soon as the previous run finishes
+OVERLAP_ALLOW = "allow"     # Start anyway, runs overlap
+OVERLAP_POLICIES = [OVERLAP_SKIP, OVERLAP_WAIT, OVERLAP_ALLOW]
+
+TASK_DURATION = metrics.histogram("hashmanager_task_duration_seconds", "Duration of each scheduled task run", ["task"])
+TASK_ERRORS = metrics.counter("hashmanager_task_errors_total", "Scheduled task runs that failed", ["task", "kind"])
+TASK_SKIPPED = metrics.counter("hashmanager_task_skipped_total", "Scheduled task runs skipped because the last run was still going", ["task"])
+SLEEP_TIME = metrics.gauge("hashmanager_sleep_seconds", "Time each task slept before its last run", ["task"])
+
+
+# A blocking function run on its own cadence.
+#   interval:  seconds between the start of consecutive runs
+#   jitter:    up to this many seconds are added at random to each wait
+#   timeout:   seconds a run may take before it is abandoned, or None. The worker
+#              thread can't be killed, so an abandoned run still counts as running.
+#   overlap:   one of OVERLAP_POLICIES
+#   delay:     seconds to wait before the first run
+class Task:
+    def __init__(self, name, func, interval, jitter=0.0, timeout=None, overlap=OVERLAP_SKIP, delay=0.0):
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError("Unknown overlap policy for task {}: {}".format(name, overlap))
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.jitter = float(jitter)
+        self.timeout = timeout
+        self.overlap = overlap
+        self.delay = float(delay)
+        self.active = 0             # Runs whose worker thread hasn't returned yet
+        self.worker = None          # concurrent.futures.Future of the latest run
+        self.lock = threading.Lock()
+        self.last_run = None
+        self.last_error = None
+
+    # Start a run on executor. It counts as running from now until the thread returns,
+    # even if it was abandoned after a timeout.
+    def submit(self, executor):
+        with self.lock:
+            self.active += 1
+        try:
+            worker = executor.submit(self.func)
+        except Exception:
+            with self.lock:
+                self.active -= 1
+            raise
+        worker.add_done_callback(self.__finished)
+        self.worker = worker
+        return worker
+
+    def __finished(self, worker):
+        with self.lock:
+            self.active -= 1
+
+    def running(self):
+        with self.lock:
+            return self.active > 0
+
+    # Wait until the thread of the latest run has returned
+    async def idle(self):
+        worker = self.worker
+        if worker is not None and not worker.done():
+            await asyncio.gather(asyncio.wrap_future(worker), return_exceptions=True)
+
+
+# Runs every task on its own cadence. Task functions block, so each run goes to a
+# thread pool and independent tasks run concurrently.
+class Scheduler:
+    def __init__(self, max_workers=None):
+        self.tasks = []
+        self.max_workers = max_workers
+        self.executor = None
+        self.stopping = None
+
+    def add(self, task):
+        self.tasks.append(task)
+        return task
+
+    async def __execute(self, task):
+        start = time.perf_counter()
+        task.last_run = datetime.now()
+        try:
+            future = asyncio.wrap_future(task.submit(self.executor))
+            await asyncio.wait_for(future, task.timeout)
+            task.last_error = None
+        except asyncio.TimeoutError:
+            TASK_ERRORS.labels(task=task.name, kind="timeout").inc()
+            task.last_error = "Timed out after {} seconds".format(task.timeout)
+            print("Error: task {} timed out after {} seconds".format(task.name, task.timeout))
+        except asyncio.CancelledError:
+            raise
+        except (Exception, SystemExit) as e:
+            TASK_ERRORS.labels(task=task.name, kind="error").inc()
+            task.last_error = str(e)
+            print("Error: task {}: {}".format(task.name, str(e)))
+        finally:
+            TASK_DURATION.labels(task=task.name).observe(time.perf_counter() - start)
+
+    async def __loop(self, task):
+        loop = asyncio.get_event_loop()
+        next_run = loop.time() + task.delay
+        current = None              # Held so the latest run isn't garbage collected
+        while True:
+            wait = max(0.0, next_run - loop.time()) + random.uniform(0, task.jitter)
+            SLEEP_TIME.labels(task=task.name).set(wait)
+            await asyncio.sleep(wait)
+            next_run = max(next_run + task.interval, loop.time())
+
+            if task.running():
+                if task.overlap == OVERLAP_SKIP:
+                    TASK_SKIPPED.labels(task=task.name).inc()
+                    continue
+                if task.overlap == OVERLAP_WAIT:
+                    await task.idle()
+            current = asyncio.ensure_future(self.__execute(task))
+
+    # Run every task until stop() is called
+    async def run(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers or max(4, 2 * len(self.tasks)))
+        self.stopping = asyncio.Event()
+        loops = [asyncio.ensure_future(self.__loop(task)) for task in self.tasks]
+        try:
+            await self.stopping.wait()
+        finally:
+            for future in loops:
+                future.cancel()
+            await asyncio.gather(*loops, return_exceptions=True)
+            self.executor.shutdown(wait=False)
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+
+# Payment states, in the order a payout moves through them
+REQUESTED = "requested"     # The pool sent us an unsigned slate
+SIGNED = "signed"           # Our wallet signed it, but the pool may not have it yet
+
+
+# Durable record of the payout in progress for each pool user, so a payout
+# interrupted by a crash can be resumed instead of requesting a new payment.
+# Each user has one small JSON file, replaced atomically and fsync'd on every write.
+class SlateJournal:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, user_id):
+        return os.path.join(self.directory, "{}.json".format(user_id))
+
+    def __syncDirectory(self):
+        # Make the rename itself durable. Not possible on every platform.
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # The journal entry for user_id, or None
+    def load(self, user_id):
+        with self.lock:
+            try:
+                with open(self.__path(user_id), "r") as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+            except ValueError:
+                # A torn write can't happen with the atomic rename, but don't crash on a bad file
+                return None
+
+    # Record the state of a payout, with its slates and the amount it pays
+    def record(self, user_id, state, unsigned_slate=None, signed_slate=None, attempts=0, amount=0.0):
+        entry = {
+            "user_id": user_id,
+            "state": state,
+            "unsigned_slate": unsigned_slate,
+            "signed_slate": signed_slate,
+            "attempts": attempts,       # Times resuming this payout has failed
+            "amount": amount,           # GRIN the payout pays
+            "updated": time.time(),
+        }
+        path = self.__path(user_id)
+        with self.lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=".{}.".format(user_id), dir=self.directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            self.__syncDirectory()
+        return entry
+
+    # The payout finished, or was abandoned
+    def clear(self, user_id):
+        with self.lock:
+            try:
+                os.remove(self.__path(user_id))
+            except FileNotFoundError:
+                return
+            self.__syncDirectory()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Phreaknik
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sqlite3
+import threading
+from datetime import datetime
+from reconcile import Order, NEVER
+
+
+# Order fields persisted between runs, in column order
+FIELDS = [
+    "location",
+    "algo",
+    "price",
+    "limit_speed",
+    "alive",
+    "workers",
+    "accepted_speed",
+    "last_decreased",
+    "pending_price",
+    "pending_since",
+    "last_increased",
+]
+
+# Fields stored as unix timestamps
+DATETIME_FIELDS = ["last_decreased", "pending_since", "last_increased"]
+
+# Schema migrations, applied in order. PRAGMA user_version holds the number applied.
+MIGRATIONS = [
+    """CREATE TABLE orders (
+        id INTEGER PRIMARY KEY,
+        location INTEGER NOT NULL,
+        algo INTEGER NOT NULL,
+        price REAL,
+        limit_speed REAL,
+        alive INTEGER,
+        workers INTEGER,
+        accepted_speed REAL,
+        last_decreased REAL
+    )""",
+    "ALTER TABLE orders ADD COLUMN pending_price REAL",
+    "ALTER TABLE orders ADD COLUMN pending_since REAL",
+    "ALTER TABLE orders ADD COLUMN api_id TEXT NOT NULL DEFAULT ''",
+    "ALTER TABLE orders ADD COLUMN last_increased REAL",
+]
+
+
+# Nicehash order state kept in SQLite (WAL mode), so restarts pick up where we left off.
+# Only rows that changed since the last sync are written. Rows belong to the API key
+# given as api_id, so clients of different keys can share one database.
+class OrderStateStore:
+    def __init__(self, path, api_id=""):
+        self.path = path
+        self.api_id = str(api_id)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.__migrate()
+        self.saved = {}     # order_id -> row as last written
+
+    def __migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for number, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.db.execute("BEGIN")
+            self.db.execute(statement)
+            self.db.execute("PRAGMA user_version = {}".format(number))
+            self.db.execute("COMMIT")
+
+    @staticmethod
+    def __toRow(order):
+        row = []
+        for field in FIELDS:
+            value = getattr(order, field)
+            if isinstance(value, datetime):
+                value = value.timestamp()
+            elif isinstance(value, bool):
+                value = int(value)
+            row.append(value)
+        return tuple(row)
+
+    @staticmethod
+    def __fromRow(order_id, row):
+        fields = dict(zip(FIELDS, row))
+        fields["alive"] = bool(fields["alive"])
+        for field in DATETIME_FIELDS:
+            if fields[field] is not None:
+                fields[field] = datetime.fromtimestamp(fields[field])
+        for field in ["last_decreased", "last_increased"]:
+            if fields[field] is None:
+                fields[field] = NEVER
+        return Order(order_id, **fields)
+
+    # Read every stored order of our API key. Returns {order_id: Order}
+    # Rows written before orders were kept per key are taken over by the first key to load.
+    def load(self):
+        with self.lock:
+            self.db.execute("UPDATE orders SET api_id = ? WHERE api_id = ''", (self.api_id,))
+            columns = ", ".join(["id"] + FIELDS)
+            orders = {}
+            self.saved = {}
+            for row in self.db.execute("SELECT {} FROM orders WHERE api_id = ?".format(columns), (self.api_id,)):
+                order_id, values = row[0], tuple(row[1:])
+                self.saved[order_id] = values
+                orders[order_id] = self.__fromRow(order_id, values)
+            return orders
+
+    # Write the difference between orders and what was last stored, in one transaction
+    def sync(self, orders):
+        with self.lock:
+            rows = {int(order_id): self.__toRow(order) for order_id, order in orders.items()}
+            changed = [(order_id, self.api_id) + row for order_id, row in rows.items() if self.saved.get(order_id) != row]
+            removed = [(order_id, self.api_id) for order_id in self.saved if order_id not in rows]
+            if not changed and not removed:
+                return 0
+            placeholders = ", ".join(["?"] * (len(FIELDS) + 2))
+            columns = ", ".join(["id", "api_id"] + FIELDS)
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("INSERT OR REPLACE INTO orders ({}) VALUES ({})".format(columns, placeholders), changed)
+                self.db.executemany("DELETE FROM orders WHERE id = ? AND api_id = ?", removed)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.saved = rows
+            return len(changed) + len(removed)
+
+    def close(self):
+        with self.lock:
+            self.db.close()